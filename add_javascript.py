@@ -1,48 +1,206 @@
 #!/usr/bin/env python3
 # vim: set fileencoding=utf-8 :
 
-from pdfrw import PdfReader, PdfWriter
-from pdfrw.objects.pdfstring import PdfString
-from pdfrw.objects.pdfdict import PdfDict
-from pdfrw.objects.pdfarray import PdfArray
-
-from pdfrw.objects.pdfdict import PdfDict
-from pdfrw.objects.pdfname import PdfName
-
-
-def make_js_action(js):
-    action = PdfDict()
-    action.S = PdfName.JavaScript
-    action.JS = js
-    return action
-
-
-def append_js_to_pdf(file_name):
-    pdf_writer = PdfWriter()
-    pdf_reader = PdfReader(file_name)
-    try:
-        js = open(sys.argv[1]).read()
-    except:
-        # js = "this.getField('residency_duration_ratio').value = (event.value / 365).toString().split('.')[1];"
-        # js = "this.getField('residency_duration_ratio').value = 1"
-        js = "app.alert('hi')"
-    for page_index in pdf_reader.pages:
-        page = page_index
-        page.Type = PdfName.Page
+# Add javascript to an existing pdf's fields
+#
+#   python3 add_javascript.py [-i] [-s script.js] [-t V] [-n GLOB] [--type Tx]
+#       [-p 1-3,5] [-d NAME=lib.js] in.pdf out.pdf
+#
+# The fields the selectors (-n names, --type, -p pages, all of them must
+# match) pick get the script as their -t trigger in /AA, all sharing the one
+# action object. -d adds document level scripts to /Names /JavaScript, for
+# functions the field scripts call. With -i out.pdf is in.pdf plus an
+# incremental update with just the changed objects.
+
+import argparse
+from fnmatch import fnmatchcase
+from typing import *
+
+from sys import argv
+
+from pdfrw import PdfWriter
+from pdfrw.objects import *
+
+from appearance import inherited
+from fields import partial_name, js_action, script_tree, replace_entry
+from incremental import IncrementalWriter
+from lazyreader import LazyReader
+
+# Field /AA triggers
+TRIGGERS = ('K', 'F', 'V', 'C', 'Fo', 'Bl', 'D', 'U', 'E', 'X', 'PO', 'PC', 'PV', 'PI')
+
+
+def page_range(spec: str, count: int) -> Set[int]:
+    """
+    Page indexes for a spec like 1-3,5,8- (pages counted from 1)
+    """
+    pages = set()
+    for part in spec.split(','):
+        start, dash, end = part.strip().partition('-')
         try:
-            print(page.Annots)
-            for field in page.Annots:
-                field.update(PdfDict(AA=PdfDict(V=make_js_action(js))))
-        except:
-            pass
-        # page.AA = PdfDict()
-        # page.AA.O = make_js_action(js)
-        pdf_writer.addpage(page)
-
-    pdf_writer.write('test.pdf')
-
-
-if __name__ == "__main__":
-    # javascript_added = append_js_to_pdf("/home/msirabella/Downloads/forms.pdf")
-    javascript_added = append_js_to_pdf("out.pdf")
-    # javascript_added = append_js_to_pdf("/home/msirabella/Downloads/forms.pdf")
+            start = int(start) if start else 1
+            end = (int(end) if end else count) if dash else start
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'bad page range {part!r}') from None
+        if not 1 <= start <= end <= count:
+            raise argparse.ArgumentTypeError(
+                f'page range {part!r} not within 1-{count}'
+            )
+        pages.update(range(start - 1, end))
+    return pages
+
+
+def terminal_fields(fields, prefix='') -> Iterator[Tuple[str, PdfDict]]:
+    """
+    (full name, field) for every field with a value under fields, kids
+    without a /T are just widgets
+    """
+    for field in fields or ():
+        if field.T is None:
+            continue
+        name = prefix + partial_name(field)
+        kids = [kid for kid in field.Kids or () if kid.T is not None]
+        if kids:
+            yield from terminal_fields(kids, name + '.')
+        else:
+            yield name, field
+
+
+def widgets(field) -> List[PdfDict]:
+    return [kid for kid in field.Kids or () if kid.T is None] or [field]
+
+
+class Injector:
+    """
+    Adds javascript to one pdf, keeping track of what it changed for an
+    incremental update
+
+    The same script always gets the same action object, however many fields
+    use it.
+    """
+    def __init__(self, reader: LazyReader):
+        self.reader = reader
+        # javascript -> its action
+        self.actions = {}
+        # Objects already in the file that have changed, by id
+        self.modified = {}
+
+    def changed(self, obj, container=None):
+        """
+        obj has changed, if it's direct it goes out with container
+        """
+        if isinstance(obj.indirect, tuple):
+            self.modified[id(obj)] = obj
+        elif container is not None:
+            self.changed(container)
+
+    def action(self, js: str) -> PdfDict:
+        action = self.actions.get(js)
+        if action is None:
+            action = self.actions[js] = js_action(js)
+        return action
+
+    def select(self, names=(), types=(), pages=None) -> Iterator[Tuple[str, PdfDict]]:
+        """
+        (full name, field) for the fields matching every selector given: a
+        name glob, a /FT or a widget on one of the pages (indexes)
+        """
+        acroform = self.reader.Root.AcroForm
+        if acroform is None:
+            return
+        types = {PdfName(t.lstrip('/')) for t in types}
+        on_pages = None
+        if pages is not None:
+            on_pages = set()
+            for i in pages:
+                on_pages.update(id(annot) for annot in self.reader.pages[i].Annots or ())
+        for name, field in terminal_fields(acroform.Fields):
+            if names and not any(fnmatchcase(name, glob) for glob in names):
+                continue
+            if types and inherited(field, PdfName.FT) not in types:
+                continue
+            if on_pages is not None and not any(id(w) in on_pages for w in widgets(field)):
+                continue
+            yield name, field
+
+    def add(self, fields: Iterable[PdfDict], js: str, trigger='V') -> int:
+        """
+        Make js each field's trigger action, returns how many fields
+        """
+        action = self.action(js)
+        key = PdfName(trigger)
+        fields = list(fields)
+        for field in fields:
+            replace_entry(field, PdfName.AA, {key: action}, self.changed)
+        if trigger == 'C' and fields:
+            self.calculation_order(fields)
+        return len(fields)
+
+    def calculation_order(self, fields: List[PdfDict]):
+        """
+        Calculations only run for fields in /AcroForm /CO
+        """
+        catalog = self.reader.Root
+        acroform = catalog.AcroForm
+        listed = {id(field) for field in acroform.CO or ()}
+        new = [field for field in fields if id(field) not in listed]
+        if new:
+            replace_entry(acroform, PdfName.CO, new, lambda obj: self.changed(obj, catalog))
+
+    def add_document(self, name: str, js: str):
+        """
+        A document level script, run when the pdf opens
+        """
+        catalog = self.reader.Root
+        names = catalog.Names
+        if names is None:
+            names = catalog.Names = PdfDict()
+            self.changed(catalog)
+        names.JavaScript = script_tree(names.JavaScript, {name: self.action(js)})
+        self.changed(names, catalog)
+
+    def write(self, fname, incremental=False):
+        if incremental:
+            IncrementalWriter(fname, self.reader.data, self.reader,
+                              self.modified.values()).write()
+        else:
+            PdfWriter(fname, trailer=self.reader).write()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Add javascript to a pdf')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='append an incremental update to the input pdf')
+    parser.add_argument('-s', '--script', help='javascript for the selected fields')
+    parser.add_argument('-t', '--trigger', default='V', choices=TRIGGERS,
+                        help='/AA entry the script goes in')
+    parser.add_argument('-n', '--name', action='append', default=[],
+                        help='full field name glob, a.b.*')
+    parser.add_argument('--type', action='append', default=[],
+                        help='field type, Tx, Btn, Ch or Sig')
+    parser.add_argument('-p', '--pages', help='pages the fields are on, 1-3,5')
+    parser.add_argument('-d', '--document', action='append', default=[],
+                        metavar='NAME=FILE', help='document level script')
+    parser.add_argument('pdf')
+    parser.add_argument('out')
+    args = parser.parse_args(argv[1:])
+
+    injector = Injector(LazyReader(args.pdf))
+    for spec in args.document:
+        name, _, path = spec.partition('=')
+        injector.add_document(name, open(path).read())
+    if args.script is not None:
+        pages = None
+        if args.pages is not None:
+            try:
+                pages = page_range(args.pages, len(injector.reader.pages))
+            except argparse.ArgumentTypeError as e:
+                parser.error(str(e))
+        fields = (field for _, field in injector.select(args.name, args.type, pages))
+        n = injector.add(fields, open(args.script).read(), args.trigger)
+        print(f'{n} fields')
+    injector.write(args.out, args.incremental)
+
+
+if __name__ == '__main__':
+    main(argv)
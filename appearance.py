@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# Appearance streams for filled fields
+#
+# Without an /AP a viewer has to lay out every value itself (NeedAppearances),
+# which is slow to open and some viewers get wrong, mupdf ignores /Q on comb
+# fields for one. This draws the normal appearance for the field types
+# pdfmarklib.ps makes: text, comb text, checkboxes and radio buttons.
+
+import re
+from typing import *
+
+from pdfrw.objects import *
+
+
+# Glyph widths (per 1000) of the standard fonts for 32-126, everything else
+# gets the font's missing width
+STANDARD_WIDTHS = {
+    '/Helvetica': [
+        278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333,
+        278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278,
+        584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278,
+        500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944,
+        667, 667, 611, 278, 278, 278, 469, 556, 333, 556, 556, 500, 556, 556,
+        278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500,
+        278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+    ],
+}
+# Just the ones that get used as checkmarks
+DINGBAT_WIDTHS = {'4': 846, 'l': 791, 'n': 762, 'u': 759}
+
+# Cap heights (per 1000) for centering a line vertically
+CAP_HEIGHTS = {'/Helvetica': 718, '/ZapfDingbats': 700}
+
+DA_FONT = re.compile(r'/(\S+)\s+([\d.]+)\s+Tf')
+
+FfMultiLine = 1 << 12
+FfComb = 1 << 24
+FfRadio = 1 << 15
+FfPushButton = 1 << 16
+
+# Space between the border and the text
+PADDING = 2
+
+
+class Metrics(NamedTuple):
+    first: int
+    widths: List[float]
+    missing: float
+    cap_height: float
+
+    def width(self, text: str, size) -> float:
+        first, widths, missing = self.first, self.widths, self.missing
+        total = 0
+        for c in text:
+            i = ord(c) - first
+            total += widths[i] if 0 <= i < len(widths) else missing
+        return total * size / 1000
+
+
+def metrics(font: PdfDict) -> Metrics:
+    """
+    Widths for a font, from /Widths if it has them or the standard font's
+    """
+    base = font.BaseFont
+    descriptor = font.FontDescriptor
+    cap_height = float(descriptor.CapHeight) if descriptor and descriptor.CapHeight \
+        else CAP_HEIGHTS.get(base, 700)
+    if font.Widths is not None:
+        missing = float(descriptor.MissingWidth) if descriptor and descriptor.MissingWidth else 0
+        return Metrics(int(font.FirstChar or 0), [float(w) for w in font.Widths],
+                       missing, cap_height)
+    if base == '/ZapfDingbats':
+        widths = [DINGBAT_WIDTHS.get(chr(c), 788) for c in range(32, 127)]
+        return Metrics(32, widths, 788, cap_height)
+    return Metrics(32, STANDARD_WIDTHS['/Helvetica'], 556, cap_height)
+
+
+def literal(text: str) -> str:
+    """
+    A pdf string literal for a content stream, close enough to PDFDocEncoding
+    """
+    text = text.encode('latin-1', 'replace').decode('latin-1')
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def color(values, stroke=False) -> str:
+    ops = {1: 'g', 3: 'rg', 4: 'k'}.get(len(values))
+    if ops is None:
+        return ''
+    if stroke:
+        ops = ops.upper()
+    return ' '.join(str(v) for v in values) + ' ' + ops
+
+
+def inherited(field, key):
+    while field is not None:
+        if field[key] is not None:
+            return field[key]
+        field = field.Parent
+    return None
+
+
+def rect(widget) -> Tuple[float, float]:
+    x1, y1, x2, y2 = (float(v) for v in widget.Rect)
+    return abs(x2 - x1), abs(y2 - y1)
+
+
+class Appearances:
+    """
+    Makes /AP for widgets, with fonts from an /AcroForm /DR
+
+    Widths are worked out once per font, and the streams go through pool so
+    fields with the same look and value share one.
+    """
+    def __init__(self, dr: Optional[PdfDict], pool=None, da='/Helv 0 Tf 0 g'):
+        self.fonts = (dr and dr.Font) or PdfDict()
+        self.pool = pool
+        self.da = da
+        # Font name -> (font, Metrics)
+        self.cache = {}
+        # Font name -> /Resources
+        self.resources = {}
+
+    def font(self, name: str) -> Tuple[PdfDict, Metrics]:
+        cached = self.cache.get(name)
+        if cached is None:
+            font = self.fonts[PdfName(name)]
+            if font is None:
+                # Not in /DR, make do with Helvetica
+                font = PdfDict(Type=PdfName.Font, Subtype=PdfName.Type1,
+                               BaseFont=PdfName.Helvetica)
+                font.indirect = True
+            cached = self.cache[name] = (font, metrics(font))
+        return cached
+
+    def resource(self, name: str) -> PdfDict:
+        resources = self.resources.get(name)
+        if resources is None:
+            font, _ = self.font(name)
+            resources = self.resources[name] = PdfDict(
+                Font=PdfDict({PdfName(name): font}),
+                ProcSet=PdfArray([PdfName.PDF, PdfName.Text]),
+            )
+        return resources
+
+    def form(self, widget, content: str, font: Optional[str]) -> PdfDict:
+        w, h = rect(widget)
+        xobject = PdfDict(
+            Type=PdfName.XObject,
+            Subtype=PdfName.Form,
+            BBox=PdfArray([0, 0, round(w, 3), round(h, 3)]),
+        )
+        if font is not None:
+            xobject.Resources = self.resource(font)
+        xobject.stream = content
+        if self.pool is not None:
+            xobject.BBox = self.pool(xobject.BBox)
+            xobject = self.pool(xobject)
+        xobject.indirect = True
+        return xobject
+
+    def border(self, widget) -> str:
+        """
+        The /MK background and border, the viewer won't draw them over an /AP
+        """
+        mk = widget.MK
+        if mk is None:
+            return ''
+        w, h = rect(widget)
+        ops = []
+        if mk.BG:
+            ops.append(f'{color(mk.BG)} 0 0 {w:g} {h:g} re f')
+        if mk.BC:
+            bw = float(widget.BS.W) if widget.BS and widget.BS.W is not None else 1
+            if bw:
+                ops.append(f'{color(mk.BC, True)} {bw:g} w '
+                           f'{bw / 2:g} {bw / 2:g} {w - bw:g} {h - bw:g} re S')
+        return ' '.join(ops)
+
+    def da_of(self, field) -> Tuple[str, float, str]:
+        """
+        Font name, size (0 for auto) and the rest of the /DA
+        """
+        da = inherited(field, PdfName.DA)
+        da = da.decode() if isinstance(da, PdfString) else str(da or self.da)
+        match = DA_FONT.search(da)
+        if match is None:
+            match = DA_FONT.search(self.da)
+            rest = da
+        else:
+            rest = da[:match.start()] + da[match.end():]
+        return match.group(1), float(match.group(2)), ' '.join(rest.split())
+
+    def text(self, field, widget, value: str) -> PdfDict:
+        name, size, rest = self.da_of(field)
+        _, m = self.font(name)
+        w, h = rect(widget)
+        flags = int(inherited(field, PdfName.Ff) or 0)
+        q = int(inherited(field, PdfName.Q) or 0)
+        maxlen = inherited(field, PdfName.MaxLen)
+
+        ops = []
+        if flags & FfComb and maxlen and not flags & FfMultiLine:
+            cells = int(maxlen)
+            value = value[:cells]
+            cell = w / cells
+            if not size:
+                widest = max((m.width(c, 1) for c in value), default=0)
+                size = min(h * 0.7, (cell - 1) / widest if widest else h)
+            y = (h - m.cap_height * size / 1000) / 2
+            # /Q picks which cells a short value goes in
+            start = {1: (cells - len(value)) // 2, 2: cells - len(value)}.get(q, 0)
+            x = 0
+            for i, c in enumerate(value, start):
+                cx = i * cell + (cell - m.width(c, size)) / 2
+                ops.append(f'{cx - x:.3f} {y if not ops else 0:.3f} Td {literal(c)} Tj')
+                x = cx
+        elif flags & FfMultiLine:
+            size = size or 12
+            lines = self.wrap(value, m, size, w - 2 * PADDING)
+            leading = size * 1.15
+            y = h - PADDING - size
+            for line in lines:
+                x = self.align(q, m.width(line, size), w)
+                ops.append(f'{x:.3f} {y:.3f} Td {literal(line)} Tj')
+                ops.append(f'{-x:.3f} {-y:.3f} Td')
+                y -= leading
+        else:
+            if not size:
+                width = m.width(value, 1)
+                size = h * 0.7
+                if width:
+                    size = min(size, (w - 2 * PADDING) / width)
+            y = (h - m.cap_height * size / 1000) / 2
+            x = self.align(q, m.width(value, size), w)
+            ops.append(f'{x:.3f} {y:.3f} Td {literal(value)} Tj')
+
+        content = ' '.join(filter(None, (
+            self.border(widget),
+            f'/Tx BMC q {PADDING / 2:g} {PADDING / 2:g} {w - PADDING:g} {h - PADDING:g} re W n',
+            f'BT /{name} {size:.3f} Tf {rest}',
+            ' '.join(ops),
+            'ET Q EMC',
+        )))
+        return self.form(widget, content, name)
+
+    @staticmethod
+    def align(q, width, w) -> float:
+        if q == 1:
+            return (w - width) / 2
+        elif q == 2:
+            return w - PADDING - width
+        return PADDING
+
+    @staticmethod
+    def wrap(value: str, m: Metrics, size, width) -> List[str]:
+        lines = []
+        for paragraph in value.splitlines() or ['']:
+            line = ''
+            for word in paragraph.split(' '):
+                candidate = f'{line} {word}' if line else word
+                if line and m.width(candidate, size) > width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return lines
+
+    def check(self, field, widget) -> PdfDict:
+        """
+        The on state of a checkbox or radio button, /MK /CA in ZapfDingbats
+        """
+        name, size, rest = self.da_of(field)
+        _, m = self.font(name)
+        w, h = rect(widget)
+        radio = int(inherited(field, PdfName.Ff) or 0) & FfRadio
+        mark = widget.MK and widget.MK.CA
+        mark = mark.decode() if isinstance(mark, PdfString) else ('l' if radio else '4')
+        if not size:
+            size = min(w, h) * 0.72
+        x = (w - m.width(mark, size)) / 2
+        y = (h - m.cap_height * size / 1000) / 2
+        content = ' '.join(filter(None, (
+            self.border(widget),
+            f'q BT /{name} {size:.3f} Tf {rest} {x:.3f} {y:.3f} Td {literal(mark)} Tj ET Q',
+        )))
+        return self.form(widget, content, name)
+
+    def update(self, field):
+        """
+        Draw the /AP of each of field's widgets for its current /V
+        """
+        widgets = [kid for kid in field.Kids or () if kid.T is None] or [field]
+        # Parents made with pdfmarklib's parent are widgets with nowhere to go
+        widgets = [widget for widget in widgets if widget.Rect is not None]
+        ft = inherited(field, PdfName.FT)
+        if ft == PdfName.Tx:
+            value = field.V
+            value = value.decode() if isinstance(value, PdfString) else str(value or '')
+            for widget in widgets:
+                widget.AP = PdfDict(N=self.text(field, widget, value))
+        elif ft == PdfName.Btn:
+            if int(inherited(field, PdfName.Ff) or 0) & FfPushButton:
+                return
+            for i, widget in enumerate(widgets):
+                if widget.AP is not None:
+                    # Came with its own, like MoonNotes
+                    continue
+                # The on state is whatever it's showing, or else the value
+                # for a lone widget and the /Opt index for radio kids
+                state = widget.AS
+                if state in (None, PdfName.Off):
+                    state = field.V if len(widgets) == 1 else PdfName(str(i))
+                if state in (None, PdfName.Off):
+                    state = PdfName.Yes
+                widget.AP = PdfDict(N=PdfDict({
+                    state: self.check(field, widget),
+                    PdfName.Off: self.form(widget, self.border(widget), None),
+                }))
+                widget.AS = state if field.V == state else PdfName.Off
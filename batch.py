@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# Fill one template with lots of records
+#
+#   python3 batch.py [-j JOBS] [-i] [-f] base.pdf overlay.ps outdir records...
+#
+# records can be .fdf or .xfdf files (one record each), .csv files (a record per row,
+# header is field names) or json lines (a record per line, - for stdin).
+# The base pdf and overlay are only read once, each record gets a fork of the
+# runner the overlay ran in. With -j the records are spread over a process
+# pool. A record that fails, or can't be read, is reported and the rest
+# carry on.
+
+import os
+import re
+import csv
+import json
+import argparse
+import traceback
+import multiprocessing
+from typing import *
+from itertools import count, chain
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, ALL_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from sys import argv, stdin, stderr
+
+from pdfrw import PdfWriter
+from pdfrw.objects import *
+
+from pdfmark import PdfmarkRunner
+from fdf import read_values
+from appearance import Appearances, inherited
+from flatten import Flattener
+from incremental import IncrementalWriter
+from lazyreader import LazyReader
+
+
+def read_records(paths) -> Iterator[Tuple[str, Union[Dict[str, Any], Exception]]]:
+    """
+    (name, values) for every record, one at a time
+
+    A record that can't be read comes with the exception instead of values,
+    a whole file's worth if it's the file that's the problem.
+    """
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        try:
+            if path.endswith(('.fdf', '.xfdf')):
+                yield stem, read_values(path)
+            elif path.endswith('.csv'):
+                with open(path, newline='') as f:
+                    for i, row in enumerate(csv.DictReader(f), 1):
+                        yield f'{stem}-{i}', {k: v for k, v in row.items() if v}
+            else:
+                f = stdin if path == '-' else open(path)
+                with f:
+                    for i, line in enumerate(f, 1):
+                        if line.strip():
+                            yield f'{stem}-{i}', json_record(line)
+        except Exception as e:
+            yield stem, e
+
+
+def json_record(line: str) -> Union[Dict[str, Any], Exception]:
+    try:
+        values = json.loads(line)
+    except ValueError as e:
+        return e
+    if not isinstance(values, dict):
+        return ValueError(f'expected a json object, not {type(values).__name__}')
+    return values
+
+
+def output_name(name: str, values: Dict[str, Any]) -> str:
+    """
+    The record's _name if it has one, made safe to use as a file name
+    """
+    name = re.sub(r'[^\w.-]', '_', str(values.get('_name', name)))
+    # Not ., .. or nothing at all
+    return name if name.strip('.') else f'_{name}'
+
+
+def named(records) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    (output name, values, None) for each record to render, or (name, None,
+    error) for one that can't be, unreadable or with a name that's been used
+    """
+    seen = set()
+    for name, values in records:
+        if isinstance(values, Exception):
+            error = traceback.format_exception(type(values), values, values.__traceback__)
+            yield name, None, ''.join(error)
+            continue
+        name = output_name(name, values)
+        if name in seen:
+            yield name, None, f'another record is already called {name}, skipped\n'
+            continue
+        seen.add(name)
+        yield name, values, None
+
+
+def set_value(field, value):
+    """
+    Set field's /V, None (json null) clears it
+    """
+    if inherited(field, PdfName.FT) == PdfName.Btn:
+        widgets = field.Kids or [field]
+        if value is None:
+            field.V = None
+            for widget in widgets:
+                widget.AS = PdfName.Off
+            return
+        if value is True:
+            # Whatever the first widget calls its on state
+            states = (widgets[0].AP and widgets[0].AP.N) or {}
+            value = next((k for k in states if k != PdfName.Off), PdfName.Yes)
+        state = PdfName(str(value).lstrip('/')) if value else PdfName.Off
+        field.V = state
+        for widget in widgets:
+            states = (widget.AP and widget.AP.N) or {}
+            widget.AS = state if state in states else PdfName.Off
+    elif value is None:
+        field.V = None
+    elif isinstance(value, list):
+        field.V = PdfArray([str(v) for v in value])
+    else:
+        field.V = str(value)
+
+
+def fill(fields, values) -> Tuple[List[str], List[str]]:
+    """
+    Set /V for each value, keys starting with _ are left for the caller
+
+    Returns the names filled and the names that aren't fields, those are
+    skipped.
+    """
+    filled = []
+    unknown = []
+    for name, value in values.items():
+        if name.startswith('_'):
+            continue
+        field = fields.get(name)
+        if field is None:
+            unknown.append(name)
+            continue
+        set_value(field, value)
+        filled.append(name)
+    return filled, unknown
+
+
+def shallow_copy(obj: PdfDict) -> PdfDict:
+    """
+    Copy of a PdfDict that doesn't resolve (and load) any of its references
+    """
+    new = type(obj)()
+    dict.update(new, dict.items(obj))
+    vars(new).update(vars(obj))
+    return new
+
+
+def copy_pages(node, annots, parent=None, pagenum=None, flatten=None):
+    """
+    Copy of a page tree with annots[page index] added to each page's /Annots,
+    or drawn into the page with flatten
+
+    Only the tree's nodes get copied, so the base pdf stays untouched.
+    """
+    if pagenum is None:
+        pagenum = count()
+    new = shallow_copy(node)
+    new.indirect = True
+    if parent is not None:
+        new.Parent = parent
+    if node.Type == PdfName.Pages:
+        new.Kids = PdfArray(
+            copy_pages(kid, annots, new, pagenum, flatten) for kid in node.Kids
+        )
+    else:
+        marks = annots.get(next(pagenum))
+        if marks:
+            add_annots(new, marks, flatten)
+    return new
+
+
+def add_annots(page, marks, flatten=None):
+    if flatten is not None:
+        flatten(page, marks)
+    else:
+        page.Annots = PdfArray(list(page.Annots or []) + marks)
+
+
+class Template:
+    """
+    A base pdf with an overlay run over it, ready to fill over and over
+    """
+    def __init__(self, pdf, overlay: str):
+        self.reader = LazyReader(pdf)
+        self.runner = PdfmarkRunner(self.reader.Root)
+        self.runner(overlay)
+        # Indexed once here, forks get a copy pointing at their own fields
+        self.runner.build_fields()
+        self.runner.build_calculations(
+            Appearances(self.reader.Root.AcroForm.DR, self.runner.pool)
+        )
+        self.runner.build_library()
+        self.save = self.runner.snapshot()
+        # Record keys that aren't fields, each only gets reported once
+        self.unknown = set()
+
+    def filled(self, values: Dict[str, Any], flat=False):
+        """
+        A forked runner with values filled in, and its annotations by page
+        index, and a Flattener if flat
+        """
+        runner = self.runner.fork(self.save)
+        fields = runner.field_index()
+        names, unknown = fill(fields, values)
+        for name in unknown:
+            if name not in self.unknown:
+                self.unknown.add(name)
+                print(f'{name}: no such field, skipped', file=stderr)
+
+        annots = {}
+        for mark in runner.annots:
+            annots.setdefault(mark.SrcPg - 1, []).append(mark)
+
+        catalog = runner.objects[('Catalog',)]
+        acroform = catalog.AcroForm
+        appearances = None
+        if (names or flat) and acroform is not None:
+            # Draw the values here rather than leave it to the viewer
+            if acroform.DR is None:
+                acroform.DR = self.reader.Root.AcroForm.DR
+            appearances = Appearances(acroform.DR, runner.pool)
+            for name in names:
+                appearances.update(fields[name])
+        # Calculated fields get their values here too, drawn if the filled
+        # ones were
+        runner.evaluate(names, appearances)
+
+        flatten = None
+        if flat:
+            flatten = Flattener(appearances)
+            catalog.AcroForm = None
+        return runner, annots, flatten
+
+    def render(self, values: Dict[str, Any], flat=False) -> PdfDict:
+        """
+        Trailer for a filled copy of the template, flattened if flat
+        """
+        runner, annots, flatten = self.filled(values, flat)
+        catalog = runner.objects[('Catalog',)]
+        catalog.Pages = copy_pages(self.reader.Root.Pages, annots, flatten=flatten)
+
+        trailer = PdfDict(self.reader)
+        trailer.Root = catalog
+        return trailer
+
+    def render_update(self, values: Dict[str, Any], flat=False) -> Tuple[PdfDict, List[PdfDict]]:
+        """
+        Trailer and replaced objects for an incremental update of the base pdf
+        """
+        runner, annots, flatten = self.filled(values, flat)
+        catalog = runner.objects[('Catalog',)]
+        # Stands in for the original catalog, same object number
+        catalog.indirect = self.reader.Root.indirect
+        modified = [catalog] + list(runner.rewrite.values())
+        for pagenum, marks in annots.items():
+            page = self.reader.pages[pagenum]
+            new = shallow_copy(page)
+            add_annots(new, marks, flatten)
+            modified.append(new)
+
+        trailer = PdfDict(self.reader)
+        trailer.Root = catalog
+        return trailer, modified
+
+
+def render_one(template, outdir, name, values, incremental=False, flat=False) -> str:
+    path = os.path.join(outdir, f'{name}.pdf')
+    if incremental:
+        trailer, modified = template.render_update(values, flat)
+        IncrementalWriter(path, template.reader.data, trailer, modified).write()
+    else:
+        PdfWriter(path, trailer=template.render(values, flat)).write()
+    return name
+
+
+# Each worker process's Template, inherited from the parent when forking
+_template = None
+
+
+def _init_worker(pdf, overlay):
+    global _template
+    if _template is None:
+        _template = Template(pdf, overlay)
+
+
+def _work(outdir, name, values, incremental, flat) -> Tuple[str, Optional[str]]:
+    try:
+        return render_one(_template, outdir, name, values, incremental, flat), None
+    except Exception:
+        return name, traceback.format_exc()
+
+
+def _results(done, pending, retry, retried) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    What the done futures came back with, except that a record whose worker
+    died goes in retry, unless it's had its second go already
+    """
+    for future in done:
+        name, values = pending.pop(future)
+        try:
+            yield future.result()
+        except BrokenProcessPool:
+            if name in retried:
+                yield name, traceback.format_exc()
+            else:
+                retried.add(name)
+                retry.append((name, values, None))
+
+
+def render_all(pdf, overlay: str, outdir, records, jobs=1, inflight=None,
+               incremental=False, flat=False):
+    """
+    Render every record, yielding (name, traceback or None) as each finishes
+
+    Records that can't be read or reuse a name fail without stopping the
+    rest, see named(). With more than one job the template is built once,
+    then forked into the workers (or built once per worker where fork isn't
+    available). At most inflight records are queued at a time, so records
+    are only read as fast as the workers can keep up. If a worker dies, the
+    pool is started over and the records that were in it get one more go,
+    one at a time.
+    """
+    global _template
+    records = named(records)
+    if jobs <= 1:
+        template = Template(pdf, overlay)
+        for name, values, error in records:
+            if error is not None:
+                yield name, error
+                continue
+            try:
+                yield render_one(template, outdir, name, values, incremental, flat), None
+            except Exception:
+                yield name, traceback.format_exc()
+        return
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('fork')
+        _template = Template(pdf, overlay)
+    else:
+        ctx = multiprocessing.get_context('spawn')
+    inflight = inflight or jobs * 4
+
+    retry = []
+    retried = set()
+    while True:
+        queue = iter(retry)
+        retry = []
+        with ProcessPoolExecutor(jobs, ctx, _init_worker, (pdf, overlay)) as pool:
+            pending = {}
+            for name, values, error in chain(queue, records):
+                if error is not None:
+                    yield name, error
+                    continue
+                second = name in retried
+                if second or len(pending) >= inflight:
+                    done, _ = wait(pending, return_when=ALL_COMPLETED if second else FIRST_COMPLETED)
+                    yield from _results(done, pending, retry, retried)
+                if retry:
+                    # A worker's died, this pool's no good any more. Not this
+                    # record's fault, so that's not a go for it either.
+                    retry.append((name, values, None))
+                    break
+                try:
+                    future = pool.submit(_work, outdir, name, values, incremental, flat)
+                except BrokenProcessPool:
+                    retry.append((name, values, None))
+                    break
+                pending[future] = (name, values)
+                if second:
+                    # Its second go runs on its own, so if the pool breaks
+                    # again that's down to this record and nothing else
+                    done, _ = wait(pending)
+                    yield from _results(done, pending, retry, retried)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _results(done, pending, retry, retried)
+        # Whatever was still waiting from last time goes round again too
+        retry += queue
+        if not retry:
+            return
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Fill a template with many records')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes, 0 for one per cpu')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='append an incremental update to the base pdf')
+    parser.add_argument('-f', '--flatten', action='store_true',
+                        help='draw the fields into the pages instead')
+    parser.add_argument('pdf')
+    parser.add_argument('overlay')
+    parser.add_argument('outdir')
+    parser.add_argument('records', nargs='+')
+    args = parser.parse_args(argv[1:])
+
+    os.makedirs(args.outdir, exist_ok=True)
+    failed = 0
+    results = render_all(
+        args.pdf, open(args.overlay).read(), args.outdir,
+        read_records(args.records), args.jobs or os.cpu_count(),
+        incremental=args.incremental, flat=args.flatten
+    )
+    for name, error in results:
+        if error is not None:
+            failed += 1
+            print(f'{name}: failed', error, sep='\n', file=stderr)
+    return failed
+
+
+if __name__ == '__main__':
+    exit(1 if main(argv) else 0)
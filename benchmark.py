@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# Not run by anything, just `python3 benchmark.py` when poking at operators
+#
+# Compares the inner loop operators against the old inspect.signature based
+# stackify, which is kept around here as LegacyRunner.
+
+from timeit import repeat
+
+import postscript
+
+
+def legacy_stackify(unbound_func):
+    from functools import wraps
+    from inspect import signature
+
+    @wraps(unbound_func.__get__(int))
+    def wrapper(self):
+        func = unbound_func.__get__(self)
+        numargs = len(signature(func).parameters)
+        args = [self.pop() for _ in range(numargs)]
+        args.reverse()
+        ret = func(*args)
+        if ret is None:
+            return ()
+        if not isinstance(ret, tuple):
+            return (ret,)
+        return ret
+    return wrapper
+
+
+class LegacyRunner(postscript.Runner):
+    @legacy_stackify
+    @staticmethod
+    def func_add(a, b):
+        return a + b
+
+    @legacy_stackify
+    def func_roll(self, n, j):
+        buf = self[-n:]
+        self[-n:] = []
+        self.extend(buf[-j:] + buf[:-j])
+
+    @legacy_stackify
+    @staticmethod
+    def func_dup(a):
+        return a, a
+
+    @legacy_stackify
+    @staticmethod
+    def func_put(d, key, val):
+        d[key] = val
+
+    @legacy_stackify
+    @staticmethod
+    def func_get(d, key):
+        return (d[key],)
+
+
+benchmarks = {
+    'add': '1 2 add pop',
+    'roll': '1 2 3 3 1 roll pop pop pop',
+    'dup': '1 dup pop pop',
+    'put': 'bench 0 1 put',
+    'get': 'bench 0 get pop',
+    'exch': '1 2 exch pop pop',
+}
+
+
+def bench(cls, code, number=2000):
+    r = cls()
+    r.runline('/bench 1 array def')
+    proc = next(r.parse(r.lex('{' + code + '}')))
+    return min(repeat(lambda: r.run(proc), number=number, repeat=5))
+
+
+if __name__ == '__main__':
+    print(f'{"op":<8}{"legacy":>10}{"stackify":>10}{"speedup":>10}')
+    for name, code in benchmarks.items():
+        old = bench(LegacyRunner, code)
+        new = bench(postscript.Runner, code)
+        print(f'{name:<8}{old * 1000:>8.2f}ms{new * 1000:>8.2f}ms{old / new:>9.2f}x')
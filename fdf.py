@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# fdf and xfdf readers
+#
+# pdf object syntax is close enough to postscript that the postscript lexer
+# handles it fine, it just needs a few operators for obj/endobj/R. xfdf is
+# the same thing as xml.
+
+from typing import *
+from functools import partial
+from xml.etree import ElementTree
+
+from sys import argv
+
+import postscript
+
+stackify = postscript.Runner.stackify
+
+
+class Reference(NamedTuple):
+    num: int
+    gen: int
+
+
+class FdfRunner(postscript.Runner):
+    """
+    Just enough of pdf's object syntax to pull the fields out of an fdf
+    """
+    # Read files as latin-1 so strings come through byte for byte
+    encoding = 'latin-1'
+    lex = staticmethod(partial(postscript.lex, encoding=encoding))
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.objects = {}
+
+    @staticmethod
+    def func_obj():
+        # leave the object number on the stack for endobj
+        pass
+
+    @stackify
+    def func_endobj(self, num: int, gen: int, value) -> None:
+        self.objects[num] = value
+
+    @stackify
+    @staticmethod
+    def func_R(num: int, gen: int):
+        return Reference(num, gen)
+
+    @staticmethod
+    def func_trailer():
+        # the trailer dict just stays on the stack
+        pass
+
+    def func_stream(self):
+        # Only turn up for embedded files and appearances, never values
+        raise SyntaxError("stream in fdf: fdf streams aren't supported")
+
+    def resolve(self, obj):
+        while isinstance(obj, Reference):
+            obj = self.objects[obj.num]
+        return obj
+
+
+def text(s) -> str:
+    """
+    Decode a pdf text string, either utf-16 with a BOM or PDFDocEncoding
+    """
+    raw = bytes(iter(s))
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be')
+    # close enough to PDFDocEncoding
+    return raw.decode('latin-1')
+
+
+def value(runner, v):
+    v = runner.resolve(v)
+    if isinstance(v, postscript.String):
+        return text(v)
+    elif isinstance(v, (list, postscript.Array)):
+        return [value(runner, item) for item in v]
+    return v
+
+
+def fields(runner, kids, prefix='') -> Iterator[Tuple[str, Any]]:
+    for field in kids:
+        field = runner.resolve(field)
+        name = prefix
+        if 'T' in field:
+            name = prefix + text(runner.resolve(field['T']))
+        if 'V' in field:
+            yield name, value(runner, field['V'])
+        if 'Kids' in field:
+            yield from fields(runner, runner.resolve(field['Kids']), name + '.')
+
+
+def read_fdf(path) -> Dict[str, Any]:
+    """
+    Field values in an fdf file, by fully qualified field name
+
+    Strings come back as str, checkbox/radio states as postscript.Name.
+    """
+    with open(path, encoding='latin-1') as f:
+        source = f.read()
+    runner = FdfRunner()
+    runner(source)
+    trailer = runner[-1]
+    root = runner.resolve(trailer['Root'])
+    fdf = runner.resolve(root['FDF'])
+    return dict(fields(runner, runner.resolve(fdf.get('Fields', []))))
+
+
+def local(tag: str) -> str:
+    # Without the {http://ns.adobe.com/xfdf/} namespace
+    return tag.rpartition('}')[2]
+
+
+def xfields(parent, prefix='') -> Iterator[Tuple[str, Any]]:
+    for field in parent:
+        if local(field.tag) != 'field':
+            continue
+        name = prefix + field.get('name', '')
+        values = [v.text or '' for v in field if local(v.tag) == 'value']
+        if len(values) == 1:
+            yield name, values[0]
+        elif values:
+            yield name, values
+        yield from xfields(field, name + '.')
+
+
+def read_xfdf(path) -> Dict[str, Any]:
+    """
+    Field values in an xfdf file, by fully qualified field name
+
+    Everything comes back as str, or a list of them for multiple values.
+    """
+    root = ElementTree.parse(path).getroot()
+    values = {}
+    for fields_ in root:
+        if local(fields_.tag) == 'fields':
+            values.update(xfields(fields_))
+    return values
+
+
+def read_values(path) -> Dict[str, Any]:
+    """
+    read_xfdf or read_fdf, by extension
+    """
+    if path.lower().endswith('.xfdf'):
+        return read_xfdf(path)
+    return read_fdf(path)
+
+
+if __name__ == '__main__':
+    for name, v in read_values(argv[1]).items():
+        print(f'{name}: {v!r}')
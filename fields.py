@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# Small helpers for fields and their javascript, shared by pdfmark.py and
+# add_javascript.py
+
+from typing import *
+
+from pdfrw.objects import *
+
+
+def js_action(js: str) -> PdfDict:
+    action = PdfDict(S=PdfName.JavaScript, JS=PdfString.encode(js))
+    action.indirect = True
+    return action
+
+
+def name_tree(node) -> Iterator[Tuple[Any, Any]]:
+    """
+    (key, value) pairs of a name tree, in order
+    """
+    if node is None:
+        return
+    pairs = node.Names or ()
+    for i in range(0, len(pairs) - 1, 2):
+        yield pairs[i], pairs[i + 1]
+    for kid in node.Kids or ():
+        yield from name_tree(kid)
+
+
+def script_tree(node, scripts: Dict[str, PdfDict]) -> PdfDict:
+    """
+    A new /Names /JavaScript tree, node's scripts with scripts added
+    """
+    # Flattened into one leaf, these trees are never big
+    merged = {
+        key.decode() if isinstance(key, PdfString) else str(key): value
+        for key, value in name_tree(node)
+    }
+    merged.update(scripts)
+    return PdfDict(Names=PdfArray(
+        item for key in sorted(merged) for item in (PdfString.encode(key), merged[key])
+    ))
+
+
+def partial_name(field) -> str:
+    return field.T.decode() if isinstance(field.T, PdfString) else str(field.T)
+
+
+def replace_entry(obj: PdfDict, key, update, changed=None):
+    """
+    Set obj's key to a copy of what's there with update applied, a dict of
+    entries to set (None deletes) or a list of items to add, and tell
+    changed about obj
+
+    The old value is never changed in place: it might be pooled (see
+    pdfmark.Pool) or shared with other objects, like an /AA or /Kids.
+    """
+    old = obj[key]
+    if isinstance(update, dict):
+        new = PdfDict(old or ())
+        for k, v in update.items():
+            new[k] = v
+        new = new or None
+    else:
+        # list's own, leaving any references in there as they are
+        items = list.__iter__(old) if old else ()
+        new = PdfArray(list(items) + list(update))
+    obj[key] = new
+    if changed is not None:
+        changed(obj)
+    return new
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# Flattening
+#
+# Burns annotations into their page: each one's normal appearance becomes a
+# Form XObject drawn with Do at its /Rect, and the annotation itself goes.
+# Appearance streams are already shared between fields that look the same
+# (see Pool), so a flattened file only carries each one once.
+
+from typing import *
+
+from pdfrw.objects import *
+
+from appearance import Appearances
+
+# Annotation flags
+Hidden = 1 << 1
+
+
+def normal_appearance(annot) -> Optional[PdfDict]:
+    """
+    The Form XObject annot shows right now, if it has one
+    """
+    normal = annot.AP and annot.AP.N
+    if normal is None:
+        return None
+    if normal.BBox is None:
+        # One per state, like checkboxes
+        normal = normal[annot.AS or PdfName.Off]
+    if normal is None or normal.BBox is None:
+        return None
+    return normal
+
+
+def placement(annot, form) -> str:
+    """
+    cm operands that put form's (transformed) bounding box on annot's /Rect
+    """
+    x1, y1, x2, y2 = (float(v) for v in annot.Rect)
+    rx, ry = min(x1, x2), min(y1, y2)
+    rw, rh = abs(x2 - x1), abs(y2 - y1)
+
+    a, b, c, d, e, f = (float(v) for v in form.Matrix or (1, 0, 0, 1, 0, 0))
+    bx1, by1, bx2, by2 = (float(v) for v in form.BBox)
+    corners = [
+        (a * x + c * y + e, b * x + d * y + f)
+        for x in (bx1, bx2) for y in (by1, by2)
+    ]
+    left = min(x for x, _ in corners)
+    bottom = min(y for _, y in corners)
+    width = max(x for x, _ in corners) - left
+    height = max(y for _, y in corners) - bottom
+
+    sx = rw / width if width else 1
+    sy = rh / height if height else 1
+    return f'{sx:g} 0 0 {sy:g} {rx - left * sx:g} {ry - bottom * sy:g}'
+
+
+class Flattener:
+    """
+    Flattens the pages of one document
+
+    The original content of each page gets wrapped in q/Q, so whatever state
+    it leaves doesn't shift the appearances. The same q stream does for every
+    page.
+    """
+    def __init__(self, appearances: Optional[Appearances] = None):
+        self.appearances = appearances
+        self.save = PdfDict()
+        self.save.stream = 'q'
+        self.save.indirect = True
+
+    def __call__(self, page: PdfDict, annots):
+        """
+        Draw annots into page's content instead of adding them to /Annots
+
+        Widgets without an /AP get one from appearances, if there are any, so
+        their borders survive. page is changed in place, copy it first if
+        it's shared.
+        """
+        resources = PdfDict(page.inheritable.Resources or ())
+        xobjects = PdfDict(resources.XObject or ())
+        # Same form, same name
+        names = {}
+        ops = []
+        for annot in annots:
+            if int(annot.F or 0) & Hidden:
+                continue
+            if annot.AP is None and self.appearances is not None \
+                    and annot.Subtype == PdfName.Widget:
+                # Kids without a /T are just widgets of their parent
+                field = annot.Parent if annot.T is None and annot.Parent else annot
+                self.appearances.update(field)
+            form = normal_appearance(annot)
+            if form is None:
+                continue
+            name = names.get(id(form))
+            if name is None:
+                i = len(names)
+                while PdfName(f'Fm{i}') in xobjects:
+                    i += 1
+                name = names[id(form)] = PdfName(f'Fm{i}')
+                xobjects[name] = form
+            ops.append(f'q {placement(annot, form)} cm {name} Do Q')
+
+        if not ops:
+            return
+        resources.XObject = xobjects
+        page.Resources = resources
+
+        contents = page.Contents
+        if contents is None:
+            contents = []
+        elif not isinstance(contents, list):
+            contents = [contents]
+        drawn = PdfDict()
+        drawn.stream = 'Q\n' + '\n'.join(ops)
+        drawn.indirect = True
+        page.Contents = PdfArray([self.save] + list(contents) + [drawn])
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# Incremental update writer
+#
+# Instead of rewriting a whole pdf, copy the original bytes untouched and
+# append a section with just the new and changed objects, a new xref and a
+# trailer pointing back at the old one with /Prev.
+#
+# Objects read from the base pdf keep their (num, gen) tuple in .indirect,
+# those are only written out if they're passed in as modified. Anything else
+# indirect (indirect = True) is new and gets the next free object number.
+
+from typing import *
+
+from pdfrw.objects import *
+from pdfrw.objects.pdfindirect import PdfIndirect
+
+
+def startxref(base) -> int:
+    """
+    Offset of the last xref section in a pdf (bytes or an mmap)
+    """
+    i = base.rfind(b'startxref')
+    if i < 0:
+        raise ValueError('no startxref in base pdf')
+    return int(base[i + len('startxref'):i + 40].split()[0])
+
+
+def fmt_number(n) -> str:
+    if isinstance(n, float):
+        # PDFs don't handle exponent notation
+        return ('%.9f' % n).rstrip('0').rstrip('.')
+    return str(n)
+
+
+class IncrementalWriter:
+    """
+    Like pdfrw's PdfWriter, but appends to base instead of starting over
+
+    Either write() everything in one go, or start(), flush() objects as
+    they're ready and finish(). Each object gets its (num, gen) as .indirect
+    once it's numbered, so later flushes just refer to it.
+    """
+    def __init__(self, fname, base, trailer: PdfDict, modified=()):
+        self.fname = fname
+        self.base = base
+        self.trailer = trailer
+        self.modified = list(modified)
+        self.next_num = int(trailer.Size)
+        self.offsets = {}
+        self.f = None
+
+    def collect(self, roots, force=(), defer=()) -> list:
+        """
+        Number the new indirect objects reachable from roots, and list the
+        ones that need writing
+
+        Objects already in the file are only written if they're in force.
+        New objects in defer get a number, but are left (with everything
+        below them) for finish(), for things that might still change.
+        """
+        force = {id(obj) for obj in force}
+        defer = {id(obj) for obj in defer}
+        seen = set()
+        order = []
+
+        todo = list(roots)
+        while todo:
+            obj = todo.pop()
+            if not isinstance(obj, (dict, list)) or isinstance(obj, PdfIndirect):
+                continue
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            indirect = getattr(obj, 'indirect', False)
+            if isinstance(indirect, tuple):
+                if id(obj) not in force:
+                    # Already in the file as is
+                    continue
+                order.append(obj)
+            elif indirect:
+                obj.indirect = (self.next_num, 0)
+                self.next_num += 1
+                if id(obj) in defer:
+                    self.modified.append(obj)
+                    continue
+                order.append(obj)
+            if isinstance(obj, dict):
+                todo.extend(dict.values(obj))
+            else:
+                todo.extend(list.__iter__(obj))
+        return order
+
+    def fmt(self, obj) -> str:
+        if isinstance(obj, PdfIndirect):
+            return '%d %d R' % tuple(obj)
+        indirect = getattr(obj, 'indirect', False)
+        if isinstance(indirect, tuple):
+            return '%d %d R' % indirect
+        return self.fmt_direct(obj)
+
+    def fmt_direct(self, obj) -> str:
+        if isinstance(obj, dict):
+            stream = getattr(obj, 'stream', None)
+            items = ' '.join(
+                f'{k} {self.fmt(v)}'
+                for k, v in dict.items(obj)
+                if v is not None and not (k == '/Length' and stream is not None)
+            )
+            if stream is not None:
+                items += f' /Length {len(stream.encode("latin-1"))}'
+            return f'<<{items}>>'
+        elif isinstance(obj, list):
+            return '[' + ' '.join(self.fmt(v) for v in list.__iter__(obj)) + ']'
+        elif isinstance(obj, bool):
+            return 'true' if obj else 'false'
+        elif obj is None:
+            return 'null'
+        elif type(obj) is str or isinstance(obj, bytes):
+            return PdfString.encode(obj)
+        elif isinstance(obj, str):
+            # PdfName, PdfString, PdfObject are already pdf tokens
+            return obj
+        return fmt_number(obj)
+
+    def start(self):
+        """
+        Copy the base pdf over, ready for flush()
+        """
+        self.f = open(self.fname, 'wb')
+        self.f.write(self.base)
+        self.offset = len(self.base)
+        if self.base[-1:] != b'\n':
+            self.f.write(b'\n')
+            self.offset += 1
+
+    def flush(self, roots, defer=()):
+        """
+        Write out the new objects reachable from roots, see collect()
+        """
+        for obj in self.collect(roots, (), defer):
+            self.write_object(obj)
+
+    def write_object(self, obj):
+        num, gen = obj.indirect
+        body = self.fmt_direct(obj).encode('latin-1')
+        stream = getattr(obj, 'stream', None)
+        if stream is not None:
+            body += b'\nstream\n' + stream.encode('latin-1') + b'\nendstream'
+        chunk = b'%d %d obj\n%s\nendobj\n' % (num, gen, body)
+        self.offsets[num] = (self.offset, gen)
+        self.f.write(chunk)
+        self.offset += len(chunk)
+
+    def finish(self):
+        """
+        Write the modified objects and whatever else is new, then the xref
+        and trailer
+        """
+        roots = self.modified + [
+            v for k, v in dict.items(self.trailer) if k != '/Prev'
+        ]
+        for obj in self.collect(roots, self.modified):
+            self.write_object(obj)
+
+        offsets = self.offsets
+        xref = [b'xref\n']
+        nums = sorted(offsets)
+        start = 0
+        while start < len(nums):
+            end = start + 1
+            while end < len(nums) and nums[end] == nums[end - 1] + 1:
+                end += 1
+            xref.append(b'%d %d\n' % (nums[start], end - start))
+            for num in nums[start:end]:
+                xref.append(b'%010d %05d n\r\n' % offsets[num])
+            start = end
+
+        trailer = PdfDict()
+        for key in ('/Root', '/Info', '/ID', '/Encrypt'):
+            if dict.get(self.trailer, key) is not None:
+                dict.__setitem__(trailer, PdfName(key[1:]), dict.get(self.trailer, key))
+        trailer.Size = self.next_num
+        trailer.Prev = startxref(self.base)
+
+        self.f.write(b''.join(xref))
+        self.f.write(b'trailer\n%s\nstartxref\n%d\n%%%%EOF\n' % (
+            self.fmt_direct(trailer).encode('latin-1'), self.offset
+        ))
+        self.f.close()
+
+    def write(self):
+        self.start()
+        self.finish()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# Lazy pdf reader
+#
+# pdfrw's PdfReader reads (and latin-1 decodes) the whole file up front, even
+# though it only parses objects as they're resolved. For forms with scanned
+# backgrounds that's mostly image data we never look at. LazyReader maps the
+# file instead and only pulls in the bytes of an object when it's resolved,
+# and a stream's data only when something asks for .stream.
+
+import re
+import mmap
+from typing import *
+
+from pdfrw import PdfReader
+from pdfrw.tokens import PdfTokens
+from pdfrw.objects import *
+from pdfrw.errors import PdfParseError, log
+
+from incremental import startxref
+
+# Where an object's tokens end, either at its stream data or at endobj
+OBJECT_END = re.compile(rb'\bstream(?:\r\n|\n|\r)|\bendobj\b')
+ENDSTREAM = re.compile(rb'[\r\n]*endstream')
+
+
+class LazyStream(PdfDict):
+    """
+    A stream object whose data stays in the file until it's asked for
+    """
+    @property
+    def stream(self):
+        attrs = vars(self)
+        if 'stream' not in attrs:
+            data, start = attrs.pop('_data')
+            length = int(self.Length)
+            end = start + length
+            if not ENDSTREAM.match(data, end):
+                # /Length is off, go by endstream instead
+                end = ENDSTREAM.search(data, start).start()
+            attrs['stream'] = data[start:end].decode('latin-1')
+        return attrs['stream']
+
+
+class LazyReader(PdfReader):
+    """
+    PdfReader over a memory map of the file
+
+    Only the xref sections and the page tree are read when opening, everything
+    else is parsed when it's resolved. Objects in object streams are loaded a
+    whole object stream at a time. Encrypted files aren't supported.
+    """
+    def __init__(self, fname, verbose=True):
+        private = self.private
+        private.verbose = verbose
+        with open(fname, 'rb') as f:
+            private.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self.data.find(b'%PDF-', 0, 1024)
+        if header < 0:
+            raise PdfParseError(f'Invalid PDF header in {fname}')
+        private.version = self.data[header + 5:header + 8].decode('latin-1')
+
+        private.indirect_objects = {}
+        private.deferred_objects = set()
+        private.special = {
+            '<<': self.readdict,
+            '[': self.readarray,
+            'endobj': self.empty_obj,
+        }
+        for tok in r'\ ( ) < > { } ] >> %'.split():
+            self.special[tok] = self.badtoken
+        private.crypt_filters = None
+
+        # (num, gen) -> file offset, or (object stream number,) if compressed
+        private.locations = {}
+        trailer = None
+        offset = startxref(self.data)
+        while offset is not None:
+            section, is_stream = self.read_xref(offset)
+            if trailer is None:
+                trailer = section
+                stream_trailer = is_stream
+            offset = section.Prev and int(section.Prev)
+
+        if stream_trailer:
+            self.Root = trailer.Root
+            self.Info = trailer.Info
+            self.ID = trailer.ID
+            self.Size = trailer.Size
+            self.Encrypt = trailer.Encrypt
+        else:
+            self.update(trailer)
+            self.Prev = None
+        if self.Encrypt is not None:
+            raise PdfParseError('Encrypted PDFs are not supported')
+
+        private.pages = self.readpages(self.Root)
+        private.numPages = len(self.pages)
+
+    def window(self, start, end=-1) -> PdfTokens:
+        """
+        Tokens for just part of the file
+        """
+        data = self.data[start:end if end >= 0 else len(self.data)]
+        return PdfTokens(data.decode('latin-1'), 0, False, self.verbose)
+
+    def read_xref(self, offset) -> Tuple[PdfDict, bool]:
+        """
+        Read the xref section at offset into locations, returning its trailer
+        """
+        # Every section (table or stream) is followed by its own startxref
+        source = self.window(offset, self.data.find(b'startxref', offset))
+        source.obj_offsets = {}
+        trailer, is_stream = self.parsexref(source)
+
+        locations = self.locations
+        for key, location in source.obj_offsets.items():
+            # Sections are read newest first
+            locations.setdefault(key, location)
+        if is_stream:
+            for stmnum, objects in trailer.object_streams.items():
+                for num, index in objects:
+                    locations.setdefault((num, 0), (stmnum,))
+        return trailer, is_stream
+
+    def loadindirect(self, key, PdfIndirect=PdfIndirect):
+        result = self.indirect_objects.get(key)
+        if not isinstance(result, PdfIndirect):
+            return result
+        location = self.locations.get(key)
+        if location is None:
+            self.warning(f'Did not find PDF object {key}')
+            return None
+        if isinstance(location, tuple):
+            self.load_stream_objects([location[0]])
+            return self.indirect_objects.get(key)
+
+        data = self.data
+        end = OBJECT_END.search(data, location)
+        source = self.window(location, end.start() if end else -1)
+        objid = source.multiple(3)
+        if objid != [str(key[0]), str(key[1]), 'obj']:
+            self.warning(f'Expected indirect object {key} at {location}')
+            return None
+
+        obj = source.next()
+        func = self.special.get(obj)
+        if func is not None:
+            obj = func(source)
+        if end and end.group().startswith(b'stream'):
+            stream = LazyStream()
+            dict.update(stream, dict.items(obj))
+            vars(stream)['_data'] = (data, end.end())
+            obj = stream
+
+        obj.indirect = key
+        self.indirect_objects[key] = obj
+        self.deferred_objects.discard(key)
+        return obj
+
+    def warning(self, msg):
+        if self.verbose:
+            log.warning(msg)
@@ -1,73 +1,304 @@
 #!/usr/bin/env python3
 # vim: set fileencoding=utf-8 :
 
-from pdfrw import PdfReader, PdfWriter
+import re
+import heapq
+from typing import *
+
+from pdfrw import PdfWriter
 from pdfrw.objects import *
 
 
 from sys import argv
 
 import postscript
+from incremental import IncrementalWriter
+from appearance import Appearances, inherited
+from fields import partial_name, js_action, script_tree, replace_entry
+from flatten import Flattener
+from ps2js import Compiler, Calculator, Library, Expr, field_value, to_string, reads
+from lazyreader import LazyReader
+
+
+# What the interpreter raises for a procedure it can't run: typecheck,
+# stackunderflow, undefined and co.
+CALCULATION_ERRORS = (TypeError, IndexError, ValueError, KeyError)
+
+# One PdfName per name, templates repeat /T, /Rect and co. a lot
+pdf_names = {}
+
+
+class Pool:
+    """
+    Hash-consing for translated values
+
+    Identical dicts and arrays come back as the same object, and dicts that
+    end up shared are made indirect so a file only carries them once. Don't
+    change a pooled value in place, everything sharing it would change too.
+    """
+    def __init__(self):
+        self.values = {}
+
+    @staticmethod
+    def ident(v):
+        # Anything nested has been pooled already, so identity will do
+        if isinstance(v, (dict, list)):
+            return id(v)
+        return (type(v), v)
+
+    def key(self, obj):
+        if isinstance(obj, dict):
+            items = tuple(sorted((k, self.ident(v)) for k, v in dict.items(obj)))
+            return ('dict', items, getattr(obj, 'stream', None))
+        return ('array', tuple(self.ident(v) for v in list.__iter__(obj)))
+
+    def __call__(self, obj):
+        if not isinstance(obj, (dict, list)) or getattr(obj, 'indirect', False):
+            return obj
+        key = self.key(obj)
+        pooled = self.values.get(key)
+        if pooled is None or self.key(pooled) != key:
+            # New, or the pooled one has been changed since
+            self.values[key] = obj
+            return obj
+        if isinstance(pooled, PdfDict) and not pooled.indirect:
+            pooled.indirect = True
+        return pooled
+
+
+# this.getField("name") in calculation javascript, or with single quotes
+GET_FIELD = re.compile(r'''this\.getField\(\s*(["'])(.*?)\1\s*\)''')
+
+
+def calculation(field) -> Optional[str]:
+    """
+    The javascript in a field's /AA /C, if it has one
+    """
+    action = field.AA and field.AA.C
+    if action is None or action.JS is None:
+        return None
+    js = action.JS
+    if isinstance(js, PdfDict):
+        js = js.stream
+    elif isinstance(js, PdfString):
+        js = js.decode()
+    return str(js)
+
+
+def current_value(field):
+    """
+    A field's value the way its javascript .value would see it
+    """
+    v = field.V
+    if isinstance(v, PdfString):
+        v = v.decode()
+    elif isinstance(v, str) and v.startswith('/'):
+        # A PdfName, checkboxes and radio buttons
+        v = v[1:]
+    elif v is None and inherited(field, PdfName.FT) == PdfName.Btn:
+        v = 'Off'
+    elif isinstance(v, list):
+        v = ','.join(x.decode() if isinstance(x, PdfString) else str(x) for x in v)
+    return field_value('' if v is None else str(v))
+
+
+class Source(NamedTuple):
+    """
+    What ps2js compiled some calculation javascript from, as it was then
+    """
+    proc: postscript.ExecutableArray
+    # Variable -> full name of the field it held
+    names: Dict[postscript.ExecutableName, str]
+    # Compiler.tree() of proc, None if it doesn't make one
+    exprs: Optional[List[Expr]]
+
+
+def ref_key(ref) -> tuple:
+    """
+    objects key for a {name} reference
+    """
+    if isinstance(ref, postscript.ExecutableArray):
+        return ref.key()
+    return tuple(ref)
 
 
-r = PdfReader(argv[1] if len(argv) > 1 else 'dor-2020-inc-form-1-nrpy.pdf')
-
-
-def translate(d, objdict):
-    if isinstance(d, postscript.ExecutableArray):
-        d = tuple(d)
-        return objdict.setdefault(d, IndirectPdfDict())
-    elif isinstance(d, dict):
-        return PdfDict({translate(k, objdict): translate(v, objdict) for k, v in d.items()})
-    elif isinstance(d, (list, postscript.Array)):
-        return [translate(item, objdict) for item in d]
-    elif isinstance(d, postscript.Name):
-        return PdfName(d)
-    elif isinstance(d, postscript.String):
-        return str(d)
-    elif isinstance(d, bool):
-        # Can get rid of this once pdfrw#220 comes through
-        return PdfObject('true') if d else PdfObject('false')
-
-    return d
-
-ZaDb = r.Root.AcroForm.DR.Font.ZaDb
-
-moon_notes = IndirectPdfDict({
-    PdfName('BBox'): [0, 0, 13, 13],
-    PdfName('Resources'): PdfDict({
-        PdfName('Font'): PdfDict({
-            PdfName('ZaDb'): ZaDb
-        }),
-        PdfName('ProcSet'): [PdfName('PDF'), PdfName('Text')],
-    }),
-})
-# Not sure how to get this...
-moon_notes.stream = '/ZaDb 14 Tf 0 g  1 0 0 1 1  2.5  Tm (l) Tj ET Q'
-
-moon_notes_off = IndirectPdfDict({
-    PdfName('BBox'): [0, 0, 13, 13],
-    PdfName('Resources'): PdfDict({
-        PdfName('ProcSet'): [PdfName('PDF')],
-    }),
-})
-moon_notes_off.stream = ''
+class Translator:
+    """
+    PostScript values to pdfrw objects, for one pdfmark
+
+    Each source dict or array is converted once, so parts that are shared
+    come out shared, and values nested inside go through pool. A dict or
+    array that contains itself comes out as an indirect object rather than
+    recursing forever.
+    """
+    def __init__(self, objdict, pool=None):
+        self.objdict = objdict
+        self.pool = pool
+        self.memo = {}
+        self.active = set()
+
+    def __call__(self, d):
+        if isinstance(d, postscript.ExecutableArray):
+            key = ref_key(d)
+            obj = self.objdict.get(key)
+            if obj is None:
+                obj = self.objdict[key] = IndirectPdfDict()
+            return obj
+        elif isinstance(d, (dict, list, postscript.Array)):
+            new = self.memo.get(id(d))
+            if new is not None:
+                if id(new) in self.active:
+                    # Got back to something still being converted
+                    new.indirect = True
+                return new
+            if isinstance(d, dict):
+                new = self.memo[id(d)] = PdfDict()
+                self.active.add(id(new))
+                for k, v in d.items():
+                    new[self(k)] = self.nested(v)
+            else:
+                new = self.memo[id(d)] = PdfArray()
+                self.active.add(id(new))
+                list.extend(new, [self.nested(item) for item in d])
+            self.active.discard(id(new))
+            return new
+        elif isinstance(d, postscript.Name):
+            name = pdf_names.get(d)
+            if name is None:
+                name = pdf_names[d] = PdfName(d)
+            return name
+        elif isinstance(d, postscript.String):
+            return str(d)
+        elif isinstance(d, bool):
+            # Can get rid of this once pdfrw#220 comes through
+            return PdfObject('true') if d else PdfObject('false')
+
+        return d
+
+    def nested(self, v):
+        new = self(v)
+        if self.pool is None or id(new) in self.active:
+            return new
+        pooled = self.pool(new)
+        if pooled is not new:
+            # Later uses of v get the shared copy straight away
+            self.memo[id(v)] = pooled
+        return pooled
+
+
+def field_key(field):
+    """
+    The same for a field and release()'s reference to it
+    """
+    if isinstance(field, PdfIndirect):
+        return tuple(field)
+    if isinstance(field.indirect, tuple):
+        return field.indirect
+    return id(field)
+
+
+def written_copy(field) -> PdfDict:
+    """
+    A field that's been written, with everything else written replaced by
+    references so it doesn't keep them in memory
+
+    /Parent stays as it is, parents are still being built.
+    """
+    def ref(obj):
+        if isinstance(getattr(obj, 'indirect', None), tuple):
+            return PdfIndirect(obj.indirect)
+        if isinstance(obj, dict):
+            new = PdfDict()
+            dict.update(new, {k: ref(v) for k, v in dict.items(obj)})
+            return new
+        if isinstance(obj, list) and not isinstance(obj, PdfIndirect):
+            return PdfArray([ref(item) for item in list.__iter__(obj)])
+        return obj
+
+    new = PdfDict()
+    dict.update(new, {
+        k: v if k == '/Parent' else ref(v) for k, v in dict.items(field)
+    })
+    return new
+
+
+def translate(d, objdict, pool=None):
+    """
+    PostScript value to pdfrw, values nested inside d go through pool
+    """
+    return Translator(objdict, pool)(d)
+
 
 class PdfmarkRunner(postscript.Runner):
     def __init__(self, catalog, *args):
         super().__init__(*args)
         self.annots = []
         self.page = 1
+        # Page index -> references to annotations already handed to a writer
+        self.flushed = {}
+        # Objects already in a file (the base pdf, or flushed) that a pdfmark
+        # has changed since, by id
+        self.rewrite = {}
+        self.pool = Pool()
+        # Called at every showpage, see flush()
+        self.on_showpage = None
+        # Fully qualified field name -> field, see field_index()
+        self.fields = {}
+        # A pdfmark has moved or renamed a field since fields was built
+        self.stale = False
+        # References to top level fields release() has let go of
+        self.top = set()
+        # Reference -> what release() kept of a named field, see revive()
+        self.released = {}
+        # Top level fields without a name, as the pdfmarks made them
+        self.unnamed = []
+        # Calculation javascript -> the Source ps2js made it from
+        self.sources = {}
+        # ps2js's output by procedure, see Compiler
+        self.compiled = {}
+        # Calculated field name -> names it reads, in /CO order, see
+        # build_calculations()
+        self.calculated = {}
+
+        ZaDb = catalog.AcroForm.DR.Font.ZaDb
+        # The overlay writes /AcroForm into the catalog, so work on a copy
+        # and leave the base pdf alone
+        catalog = PdfDict(catalog)
+        catalog.indirect = True
 
         self.objects = {
             ('Catalog',): catalog,
             ('ZaDb',): ZaDb,
         }
 
+    def copy_pdf(self, obj, memo):
+        if isinstance(obj, PdfDict):
+            new = memo[id(obj)] = type(obj)()
+            vars(new).update(vars(obj))
+            for key, value in dict.items(obj):
+                dict.__setitem__(new, key, self.copy_value(value, memo))
+        else:
+            new = memo[id(obj)] = type(obj)()
+            new.indirect = obj.indirect
+            list.extend(new, (self.copy_value(item, memo) for item in list.__iter__(obj)))
+        return new
+
+    def copy_value(self, obj, memo):
+        if isinstance(obj, Pool):
+            # The pool's values belong to the original, start over
+            return Pool()
+        # Objects straight out of the base pdf are shared, everything the
+        # overlay made gets copied
+        if isinstance(obj, (PdfDict, PdfArray)) and not isinstance(obj.indirect, tuple):
+            new = memo.get(id(obj))
+            if new is None:
+                new = self.copy_pdf(obj, memo)
+            return new
+        return super().copy_value(obj, memo)
+
     def pdfmark_OBJ(self):
         d = self.func_hex_3E3E()
-        ref = d.pop(postscript.Name('_objdef'))
-        ref = tuple(ref)
+        ref = ref_key(d.pop(postscript.Name('_objdef')))
         t = str(d.pop(postscript.Name('type')))
         if t == 'dict' or t == 'stream':
             self.objects.setdefault(ref, IndirectPdfDict())
@@ -81,70 +312,550 @@ class PdfmarkRunner(postscript.Runner):
 
     def pdfmark_PUT(self):
         ref, stuff = self.func_unmark()
-        ref = tuple(ref)
+        ref = ref_key(ref)
         obj = self.objects.setdefault(ref, IndirectPdfDict())
         if isinstance(stuff, postscript.String):
             obj.stream = str(stuff)
         elif isinstance(obj, dict):
-            obj.update(translate(stuff, self.objects))
+            d = translate(stuff, self.objects, self.pool)
+            obj.update(d)
+            if '/Parent' in d or '/T' in d:
+                self.stale = True
         else:
             raise Exception(stuff)
+        self.changed(obj)
 
     def pdfmark_APPEND(self):
         ref, stuff = self.func_unmark()
-        ref = tuple(ref)
+        ref = ref_key(ref)
         obj = self.objects.setdefault(ref, IndirectPdfDict())
         if isinstance(obj, list):
-            obj.append(translate(stuff, self.objects))
+            obj.append(self.pool(translate(stuff, self.objects, self.pool)))
         else:
             raise Exception(stuff)
+        self.changed(obj)
 
     def pdfmark_CLOSE(self):
         self.runline("cleartomark")
 
     def pdfmark_ANN(self):
         annot = self.func_hex_3E3E()
-        ref = tuple(annot.pop(postscript.Name('_objdef'), [None]))
-        d = translate(annot, self.objects)
+        ref = annot.pop(postscript.Name('_objdef'), None)
+        d = translate(annot, self.objects, self.pool)
 
         if ref is not None:
+            ref = ref_key(ref)
             if ref in self.objects:
+                if '/Parent' in d or '/T' in d:
+                    # Others might be named after it already
+                    self.stale = True
                 self.objects[ref].update(d)
+                self.changed(self.objects[ref])
             else:
                 self.objects[ref] = d
             d = self.objects[ref]
 
-        d.indirect = True
+        if not d.indirect:
+            d.indirect = True
         d.Type = PdfName('Annot')
         if '/SrcPg' not in d:
             d.SrcPg = self.page
-        if d.T == 'RaBF9':
-            print(d)
+        if d.T is not None and d.Parent is None and '.' in d.T:
+            self.split_name(d)
+        if not self.stale:
+            self.index(d)
+        if d.T is None and d.Parent is None and d.FT is not None:
+            self.unnamed.append(d)
         self.annots.append(d)
 
     def func_pdfmark(self):
         a = self.pop()
         getattr(self, 'pdfmark_' + a)()
 
+    def func_ps2js(self):
+        """
+        Takes over from ps2js.ps's, systemdict wins
+        """
+        proc = self.pop()
+        compiler = Compiler(self.field_ref, self.compiled)
+        out = compiler(proc)
+        if len(out) == 1 and isinstance(out[0], postscript.String):
+            # Variables can be rebound later, so keep what they held now
+            exprs = []
+            try:
+                compiler.tree(proc, exprs)
+            except (TypeError, IndexError):
+                exprs = None
+            self.sources[str(out[0])] = Source(proc, compiler.resolved, exprs)
+        return tuple(out)
+
+    def field_ref(self, name: postscript.ExecutableName) -> str:
+        """
+        Full name of the field a variable holds the id of, through the
+        labels pdfmarklib.ps's formfield keeps in bigdict
+        """
+        self.run([name])
+        entry = self.globaldict[postscript.Name('bigdict')][self.pop()]
+        parts = []
+        while entry is not None:
+            parts.append(str(entry[0]))
+            entry = entry[1]
+        return '.'.join(reversed(parts))
+
     def func_showpage(self):
+        if self.on_showpage is not None:
+            self.on_showpage()
         self.page += 1
 
+    def changed(self, obj):
+        if isinstance(obj.indirect, tuple):
+            self.rewrite[id(obj)] = obj
+
+    #
+    # Fields
+
+    def split_name(self, field):
+        """
+        Turn a dotted /T like (a.b.c) into fields a and a.b with c below them
+        """
+        *parents, field.T = partial_name(field).split('.')
+        parent = None
+        name = ''
+        for part in parents:
+            name = f'{name}.{part}' if name else part
+            node = self.field_index().get(name)
+            if isinstance(node, PdfIndirect):
+                node = self.revive(name, node)
+            if node is None:
+                node = self.fields[name] = IndirectPdfDict(T=part, Kids=PdfArray())
+                if parent is not None:
+                    node.Parent = parent
+                    self.add_kid(parent, node)
+            parent = node
+        field.Parent = parent
+        self.add_kid(parent, field)
+
+    def revive(self, name, ref):
+        """
+        Bring back a field release() let go of, to be written again with
+        whatever gets added below it
+        """
+        node = self.released.pop(ref)
+        node.indirect = tuple(ref)
+        self.fields[name] = node
+        self.top.discard(ref)
+        if node.Parent is not None:
+            # The same /Kids again, like release()
+            kids = list.__iter__(node.Parent.Kids)
+            node.Parent.Kids = PdfArray(node if kid == ref else kid for kid in kids)
+        return node
+
+    def add_kid(self, parent, kid):
+        kids = parent.Kids or []
+        # list's own, a PdfArray would try to load release()'s references
+        if not any(k is kid for k in list.__iter__(kids)):
+            replace_entry(parent, PdfName.Kids, [kid], self.changed)
+
+    def index(self, field):
+        """
+        Add a field and the fields above it to fields
+        """
+        names = []
+        chain = []
+        while field is not None:
+            if field.T is not None:
+                names.append(partial_name(field))
+                chain.append(field)
+            field = field.Parent
+        names.reverse()
+        chain.reverse()
+        fields = self.fields
+        prefix = ''
+        for part, field in zip(names, chain):
+            prefix = f'{prefix}.{part}' if prefix else part
+            fields.setdefault(prefix, field)
+
+    def field_index(self) -> Dict[str, PdfDict]:
+        """
+        Fully qualified field name -> field, parents included
+        """
+        if self.stale:
+            # Fields release() let go of are written, they keep their names
+            known = [f for f in self.fields.values() if not isinstance(f, PdfIndirect)]
+            self.fields = {
+                name: f for name, f in self.fields.items() if isinstance(f, PdfIndirect)
+            }
+            self.stale = False
+            for field in known + self.annots:
+                self.index(field)
+        return self.fields
+
+    def build_fields(self):
+        """
+        Make sure every field is in its parent's /Kids, and every top level
+        one is in /AcroForm /Fields
+        """
+        top = []
+        kids = {}
+        for field in self.field_index().values():
+            if isinstance(field, PdfIndirect):
+                # Already in its parent's /Kids, see release()
+                if field in self.top:
+                    top.append(field)
+            elif field.Parent is None:
+                top.append(field)
+            else:
+                kids.setdefault(id(field.Parent), (field.Parent, []))[1].append(field)
+        for parent, children in kids.values():
+            have = {id(kid) for kid in list.__iter__(parent.Kids or [])}
+            missing = [kid for kid in children if id(kid) not in have]
+            if missing:
+                replace_entry(parent, PdfName.Kids, missing, self.changed)
+        # Fields without a name are still fields
+        top += [
+            f for f in self.unnamed
+            if isinstance(f, PdfIndirect) or (f.T is None and f.Parent is None)
+        ]
+        if not top:
+            return
+
+        catalog = self.objects[('Catalog',)]
+        if catalog.AcroForm is None:
+            catalog.AcroForm = IndirectPdfDict(Fields=PdfArray())
+        acroform = catalog.AcroForm
+        fields = acroform.Fields if acroform.Fields is not None else PdfArray()
+        # Anything that's been given a parent since doesn't belong up here
+        new = [
+            f for f in list.__iter__(fields)
+            if isinstance(f, PdfIndirect) or f.Parent is None
+        ]
+        have = {field_key(f) for f in new}
+        for f in top:
+            if field_key(f) not in have:
+                have.add(field_key(f))
+                new.append(f)
+        if [field_key(f) for f in new] != [field_key(f) for f in list.__iter__(fields)]:
+            if fields.indirect:
+                # Named, like pdfmark-prelude.ps's {afields}
+                list.__setitem__(fields, slice(None), new)
+                self.changed(fields)
+            else:
+                acroform.Fields = PdfArray(new)
+                self.changed(acroform)
+
+    #
+    # Calculations
+
+    def calculations(self) -> Dict[str, Tuple[PdfDict, str]]:
+        """
+        Field name -> (field, its /AA /C javascript) for calculated fields
+        """
+        calcs = {}
+        for name, field in self.field_index().items():
+            if isinstance(field, PdfIndirect):
+                # release() keeps the ones with /AA
+                continue
+            js = calculation(field)
+            if js is not None:
+                calcs[name] = (field, js)
+        return calcs
+
+    def build_calculations(self, appearances=None):
+        """
+        Put /AcroForm /CO in dependency order, so each calculation runs after
+        the ones it reads
+
+        Calculations that don't read any fields are worked out here instead,
+        /V gets the value (drawn with appearances if given) and the field
+        loses its /AA /C, so viewers don't run it on every keystroke.
+        """
+        calcs = self.calculations()
+        catalog = self.objects[('Catalog',)]
+        acroform = catalog.AcroForm
+        if not calcs or acroform is None:
+            return
+        co = acroform.CO if acroform.CO is not None else PdfArray()
+        position = {id(field): i for i, field in enumerate(co)}
+        order = sorted(calcs, key=lambda name: position.get(id(calcs[name][0]), len(position)))
+
+        deps = {}
+        calc = Calculator()
+        for name in order:
+            field, js = calcs[name]
+            fields = self.reads(name, js)
+            if not fields and self.precompute(calc, name, field, js):
+                if appearances is not None:
+                    appearances.update(field)
+                continue
+            deps[name] = fields - {name}
+
+        # Kahn's algorithm, taking the earliest in the old order when there's
+        # a choice so forms that are already in order stay that way
+        rank = {name: i for i, name in enumerate(order)}
+        waiting = {}
+        users = {}
+        for name, reads in deps.items():
+            reads = [dep for dep in reads if dep in deps]
+            waiting[name] = len(reads)
+            for dep in reads:
+                users.setdefault(dep, []).append(name)
+        ready = [(rank[name], name) for name, n in waiting.items() if not n]
+        heapq.heapify(ready)
+        ordered = []
+        while ready:
+            _, name = heapq.heappop(ready)
+            ordered.append(name)
+            for user in users.get(name, ()):
+                waiting[user] -= 1
+                if not waiting[user]:
+                    heapq.heappush(ready, (rank[user], user))
+        # Anything left is in a cycle, there's no right order for those
+        done = set(ordered)
+        ordered += [name for name in order if name in deps and name not in done]
+
+        self.calculated = {name: deps[name] for name in ordered}
+        new = [calcs[name][0] for name in ordered]
+        if co.indirect:
+            # Named, like pdfmarklib.ps's {CO}
+            list.__setitem__(co, slice(None), new)
+            self.changed(co)
+        else:
+            acroform.CO = PdfArray(new)
+            self.changed(acroform)
+
+    def reads(self, name: str, js: str) -> Set[str]:
+        """
+        Names of the fields the calculation for name reads, including name's
+        own if it goes through event
+
+        Taken from the tree ps2js made when it compiled js where there is
+        one, so variables are the fields they held then, and that still holds
+        after build_library() has rewritten js.
+        """
+        source = self.sources.get(js)
+        if source is not None and source.exprs is not None:
+            found = set()
+            for expr in source.exprs:
+                reads(expr, name, found)
+            return found
+        # Hand written, all there is to go on is its getField calls
+        found = {m.group(2) for m in GET_FIELD.finditer(js)}
+        if 'event' in js:
+            found.add(name)
+        return found
+
+    def precompute(self, calc: Calculator, name: str, field, js) -> bool:
+        """
+        Work out a calculation that doesn't read any fields in calc, and make
+        the result field's /V
+        """
+        source = self.sources.get(js)
+        if source is None:
+            return False
+        try:
+            field.V = calc.calculate(source.proc, name, {}, {})
+        except CALCULATION_ERRORS:
+            return False
+        replace_entry(field, PdfName.AA, {PdfName.C: None}, self.changed)
+        return True
+
+    def build_library(self, name='ps2js'):
+        """
+        Move what the calculations ps2js compiled have in common into a
+        document level script called name, see Library
+
+        Run after build_calculations(), which goes by the getField calls.
+        """
+        library = Library()
+        fields = self.field_index()
+        for field_name in self.calculated:
+            source = self.sources.get(calculation(fields[field_name]))
+            # The tree from when ps2js ran, so the rewritten action reads the
+            # same fields whatever its variables hold now
+            if source is not None and source.exprs is not None and len(source.exprs) == 1:
+                library.add(field_name, source.exprs[0])
+        if not library.exprs:
+            return
+
+        script, actions = library.build()
+        for field_name, js in actions.items():
+            field = fields[field_name]
+            # Still the same procedure, for evaluate()
+            self.sources[js] = self.sources[calculation(field)]
+            action = self.pool(PdfDict(S=PdfName.JavaScript, JS=PdfString.encode(js)))
+            replace_entry(field, PdfName.AA, {PdfName.C: action}, self.changed)
+
+        catalog = self.objects[('Catalog',)]
+        # Copied, the base pdf's might be in there
+        names = PdfDict(catalog.Names or ())
+        names.JavaScript = script_tree(names.JavaScript, {name: js_action(script)})
+        catalog.Names = names
+
+    def evaluate(self, changed: Iterable[str], appearances=None) -> List[str]:
+        """
+        Work out the calculated fields downstream of changed, the way a viewer
+        would, and return the ones whose /V changed
+
+        Each runs the procedure ps2js made its javascript from, with
+        javascript's semantics (see Calculator), in build_calculations()'s
+        order so everything it reads is already up to date. Calculations that
+        didn't come from ps2js can't be run here, neither can any that read
+        them, those are left for the viewer.
+        """
+        fields = self.field_index()
+        dirty = set(changed)
+        unknown = set()
+        updated = []
+        calc = None
+        for name, reads in self.calculated.items():
+            if not reads & dirty:
+                continue
+            field = fields[name]
+            source = self.sources.get(calculation(field))
+            if source is None or reads & unknown:
+                unknown.add(name)
+                dirty.add(name)
+                continue
+            if calc is None:
+                calc = Calculator()
+            try:
+                # Variables hold the fields they did when ps2js ran
+                values = {
+                    read: current_value(fields[read])
+                    for read in reads | set(source.names.values()) | {name}
+                    if read in fields
+                }
+                value = calc.calculate(source.proc, name, source.names, values)
+            except CALCULATION_ERRORS:
+                unknown.add(name)
+                dirty.add(name)
+                continue
+            if value == to_string(current_value(field)):
+                continue
+            field.V = value
+            self.changed(field)
+            if appearances is not None:
+                appearances.update(field)
+            dirty.add(name)
+            updated.append(name)
+        return updated
+
+    def flush(self, writer: IncrementalWriter):
+        """
+        Write the annotations so far and only keep references to them
+
+        Named objects can still be changed by a later PUT or APPEND, those
+        end up in rewrite to go out again when the writer finishes.
+        """
+        writer.flush(self.annots)
+        for annot in self.annots:
+            self.flushed.setdefault(annot.SrcPg - 1, []).append(
+                PdfIndirect(annot.indirect)
+            )
+        self.release(self.annots)
+        self.annots = []
+
+    def release(self, annots):
+        """
+        Swap written annotations for references to them in fields, /Kids
+        and unnamed, so they can be freed
+
+        Named ones can still be changed by a later pdfmark and
+        build_calculations() needs the ones with /AA, those stay. Each one let
+        go of goes in its parent's /Kids now, or top if it's top level, as
+        build_fields() can't look at it any more. Fields with a name leave a
+        written_copy() behind in case a later one goes below them.
+        """
+        named = {id(obj) for obj in self.objects.values()}
+        refs = {
+            id(annot): PdfIndirect(annot.indirect) for annot in annots
+            if id(annot) not in named and annot.AA is None
+        }
+        if not refs:
+            return
+        fields = self.field_index()
+        for name, field in fields.items():
+            ref = refs.get(id(field))
+            if ref is None:
+                continue
+            fields[name] = ref
+            self.released[ref] = written_copy(field)
+            if field.Parent is None:
+                self.top.add(ref)
+            else:
+                self.add_kid(field.Parent, field)
+        parents = {}
+        for annot in annots:
+            if id(annot) in refs and annot.Parent is not None:
+                parents[id(annot.Parent)] = annot.Parent
+        for parent in parents.values():
+            # The same /Kids, so no need to write it again
+            kids = list.__iter__(parent.Kids)
+            parent.Kids = PdfArray(refs.get(id(kid), kid) for kid in kids)
+        self.unnamed = [refs.get(id(f), f) for f in self.unnamed]
+
+
+def main(argv, template='dor-2020-inc-form-1-nrpy-form-overlay.ps', out='out.pdf'):
+    # -i appends an incremental update to the base pdf instead of rewriting it
+    # -f flattens the annotations into the pages
+    incremental = '-i' in argv
+    flat = '-f' in argv
+    argv = [arg for arg in argv if arg not in ('-i', '-f')]
+    base = argv[1] if len(argv) > 1 else 'dor-2020-inc-form-1-nrpy.pdf'
+    r = LazyReader(base)
+
+    template = open(template).read()
+    runner = PdfmarkRunner(r.Root)
+    catalog = runner.objects[('Catalog',)]
+    appearances = Appearances(r.Root.AcroForm.DR, runner.pool)
+    if incremental:
+        # The copy stands in for the original catalog
+        catalog.indirect = r.Root.indirect
+        writer = IncrementalWriter(out, r.data, r)
+        writer.start()
+    if incremental and not flat:
+        # Each page's annotations go out as soon as the overlay's done with
+        # it, instead of piling up until the end
+        runner.on_showpage = lambda: runner.flush(writer)
+        runner(template)
+        runner.flush(writer)
+        runner.build_fields()
+        runner.build_calculations(appearances)
+        runner.build_library()
+        touched = runner.flushed
+    else:
+        pdfmarks = runner(template).annots
+        runner.build_fields()
+        runner.build_calculations(appearances)
+        runner.build_library()
+        touched = {}
+        for mark in pdfmarks:
+            touched.setdefault(mark.SrcPg - 1, []).append(mark)
 
-template = open('dor-2020-inc-form-1-nrpy-form-overlay.ps').read()
-runner = PdfmarkRunner(r.Root)
-pdfmarks = runner(template).annots
+    # self.pdfmarks = PdfArray()
+    # self.pdfmarks.indirect = True
 
-# self.pdfmarks = PdfArray()
-# self.pdfmarks.indirect = True
+    pages = [r.pages[pagenum] for pagenum in touched]
+    if flat:
+        flatten = Flattener(appearances)
+        for page, marks in zip(pages, touched.values()):
+            flatten(page, marks)
+        # Nothing left to fill in
+        catalog.AcroForm = None
+    else:
+        for page, marks in zip(pages, touched.values()):
+            page.Annots = PdfArray(list(page.Annots or []) + marks)
 
-for mark in pdfmarks:
-    page = r.pages[mark.SrcPg - 1]
-    if page.Annots is None:
-        page.Annots = PdfArray()
-    page.Annots.append(mark)
 
+    # for page, annots in zip(r.pages, pdfmarks):
+    #     page.Annots = annots
 
-# for page, annots in zip(r.pages, pdfmarks):
-#     page.Annots = annots
+    r.Root = catalog
+    if incremental:
+        writer.modified += [catalog] + pages + list(runner.rewrite.values())
+        writer.finish()
+    else:
+        PdfWriter(out, trailer=r).write()
 
-PdfWriter('out.pdf', trailer=r).write()
+if __name__ == '__main__':
+    main(argv)
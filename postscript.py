@@ -3,11 +3,16 @@
 
 # postscript parser
 
+import os
+import re
+import pickle
+import hashlib
 from typing import *
 from inspect import isfunction
 
 from functools import lru_cache
-from collections import deque, UserString, UserList
+from itertools import islice
+from collections import UserString, UserList
 
 from sys import argv
 
@@ -22,68 +27,76 @@ class Executable(Protocol[T]):
 
 
 class ChildSlice(Generic[T]):
-    parent: T
-    slice: slice
+    """
+    A view of part of a buffer, (parent, offset, length)
 
-    def __init__(self, backing_array: T, slice=slice(0, None)):
+    Intervals share their parent's buffer like postscript says they should,
+    and taking an interval of an interval still points straight at the
+    buffer, so nothing gets copied and there are no chains to walk.
+    """
+    parent: T
+    offset: int
+    length: int
+    # Set once some other view might see the same buffer
+    _shared = False
+
+    def __init__(self, backing_array: T, offset=0, length=None):
+        if isinstance(backing_array, ChildSlice):
+            backing_array._shared = self._shared = True
+            offset += backing_array.offset
+            if length is None:
+                length = backing_array.length - (offset - backing_array.offset)
+            backing_array = backing_array.parent
         self.parent = backing_array
-        assert slice.step is None
-        self.slice = slice
-
-    @staticmethod
-    def _constrain_slice(o, i):
-        return slice(
-            o.start + i.start if i.start is not None else o.start,
-            o.start + i.stop if i.stop is not None else o.stop
-        )
-
-    def _add_slice(self, s):
-        if isinstance(s, int):
-            return self.slice.start + s
-        # assert (self.slice.stop is None) == (s.stop is None), breakpoint()
-        # return self._constrain_slice(self.slice,
-        return slice(
-            self.slice.start + (s.start if s.start is not None else 0),
-            self.slice.start + s.stop if s.stop is not None else None
-        )
+        self.offset = offset
+        self.length = len(backing_array) - offset if length is None else length
+
+    def _index(self, i: int) -> int:
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('rangecheck')
+        return self.offset + i
+
+    def _span(self, s: slice) -> Tuple[int, int]:
+        start, stop, step = s.indices(self.length)
+        assert step == 1
+        return self.offset + start, self.offset + max(start, stop)
 
     def __hash__(self):
         return hash(tuple(self))
 
     def __getitem__(self, index):
-        cls = type(self)
-        off_index = self._add_slice(index)
         if isinstance(index, int):
-            return self.parent[index]
-        elif off_index.start == 0 and off_index.stop is None:
+            return self.parent[self._index(index)]
+        start, stop = self._span(index)
+        if start == self.offset and stop - start == self.length:
             return self
-        return cls(self, index)
+        return type(self)(self, start - self.offset, stop - start)
 
     def __setitem__(self, index, value):
-        index = self._add_slice(index)
-        self.parent[index] = value
+        if isinstance(index, int):
+            self.parent[self._index(index)] = value
+        else:
+            start, stop = self._span(index)
+            self.parent[start:stop] = value
 
     def __iter__(self):
-        return iter(self._unwrap())
+        return islice(self.parent, self.offset, self.offset + self.length)
 
     def __len__(self):
-        return (self.slice.stop or len(self.parent)) - self.slice.start
-
-    def _unwrap(self):
-        p = self.parent
-        if isinstance(self.parent, ChildSlice):
-            p = p._unwrap()
-        return p[self.slice]
+        return self.length
 
     def __repr__(self):
-        return repr(self._unwrap())
+        return repr(self.data)
 
     def __str__(self):
-        return str(self._unwrap())
+        return str(self.data)
 
     @property
     def data(self):
-        return self._unwrap()
+        # A copy, for the UserString/UserList methods
+        return self.parent[self.offset:self.offset + self.length]
 
 
 class String(ChildSlice[bytearray], UserString):
@@ -92,29 +105,39 @@ class String(ChildSlice[bytearray], UserString):
             back = bytearray(back.encode())
         super().__init__(back, *args, **kwargs)
 
+    @property
+    def view(self) -> memoryview:
+        """
+        The string's bytes, without copying them
+        """
+        return memoryview(self.parent)[self.offset:self.offset + self.length]
+
     def __setitem__(self, index, value):
-        index = self._add_slice(index)
-        # Gotta do this since bytearray set checks for string type
-        if isinstance(value, type(self)):
-            value = iter(value)
-        if isinstance(value, Name):
-            breakpoint()
-        self.parent[index] = iter(value)
+        if isinstance(value, String):
+            # bytearray won't take a String, and an overlapping memoryview
+            # of itself needs copying first
+            value = bytes(value.view) if value.parent is self.parent else value.view
+        elif isinstance(value, str):
+            value = value.encode()
+        super().__setitem__(index, value)
+
+    def __iter__(self):
+        return iter(self.view)
 
     def __repr__(self):
-        return '(' + repr(self._unwrap().decode())[1:-1] + ')'
+        return '(' + repr(self.data)[1:-1] + ')'
 
     def __str__(self):
-        return self._unwrap().decode()
+        return self.data
 
     @property
     def data(self):
-        return super().data.decode()
+        return str(self.view, 'utf-8')
 
 
 class ExecutableString(String, Executable[String]):
     def __call__(self, stack):
-        stack.run(stack.parse(deque(stack.lex(self))))
+        stack.run(stack.parse(stack.lex(str(self))))
         return ()
 
 
@@ -123,25 +146,85 @@ class Array(ChildSlice[list], UserList):
 
 
 class ExecutableArray(Array, Executable[Array]):
+    _code = None
+    _key = None
+
     def __call__(self, stack):
         stack.run(self)
         return ()
 
+    def __setitem__(self, index, value):
+        self._code = self._key = None
+        super().__setitem__(index, value)
+
+    def __getstate__(self):
+        # Compiled code holds operator closures, it gets rebuilt on demand
+        state = self.__dict__.copy()
+        state.pop('_code', None)
+        return state
+
+    def compile(self, stack):
+        """
+        Instructions for this procedure, compiled once and reused
+        """
+        code = self._code
+        if code is None or code[0] is not stack.systemdict or self._shared:
+            code = (stack.systemdict, stack.compile(self))
+            # Only cache if every write has to go through __setitem__
+            if not self._shared:
+                self._code = code
+        return code[1]
+
+    def key(self) -> tuple:
+        """
+        The procedure's contents as a tuple, for a dict key, cached the same
+        way as compile()'s code
+        """
+        key = self._key
+        if key is None or self._shared:
+            key = tuple(self)
+            if not self._shared:
+                self._key = key
+        return key
+
     def __repr__(self):
         return f'{{{" ".join(str(item) for item in self)}}}'
 
 
 class Name(str):
+    """
+    Names are interned, there's only ever one object per name (and class)
+
+    Python already caches a str's hash, interning means dict lookups on
+    names also hit on identity instead of comparing characters, and every
+    /T in a template is the same object.
+    """
+    __slots__ = ()
+    interned: Dict[str, 'Name'] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.interned = {}
+
+    def __new__(cls, value=''):
+        if not isinstance(value, str):
+            # A String from cvn hashes as its bytes, not as the name
+            value = str(value)
+        name = cls.interned.get(value)
+        if name is None:
+            name = super().__new__(cls, value)
+            cls.interned[name] = name
+        return name
+
     def __repr__(self):
         return '/' + super().__str__()
 
 
 class ExecutableName(Name, Executable[Name]):
+    __slots__ = ()
+
     def __call__(self, stack):
-        a = stack.get_func(self)
-        if isinstance(a, Executable):
-            return a(stack)
-        return (a,)
+        return stack.bind(self)(stack)
 
     def __repr__(self):
         return super().__str__()
@@ -149,6 +232,136 @@ class ExecutableName(Name, Executable[Name]):
 
 markStart = object()
 
+# Instruction kinds for compiled procedures
+PUSH, CALL, LOOKUP = range(3)
+procStart = object()
+procEnd = object()
+
+
+#
+# Tokenizer
+
+# Anything that isn't whitespace or a delimiter is a "regular" character
+_regular = r'[^\s\x00()<>\[\]{}/%]'
+
+_token_re = re.compile(rf'''
+    (?P<space>[\s\x00]+)
+  | (?P<comment>%[^\r\n]*)
+  | (?P<string>\()
+  | (?P<dict><<|>>)
+  | (?P<hex><[^<>]*>)
+  | (?P<array>[\[\]])
+  | (?P<proc>[{{}}])
+  | (?P<name>/(?:<<|>>|[\[\]]|{_regular}*))
+  | (?P<regular>{_regular}+)
+  | (?P<error>.)
+''', re.VERBOSE | re.DOTALL)
+
+_int_re = re.compile(r'[+-]?\d+')
+_real_re = re.compile(r'[+-]?(?:\d+\.\d*|\.\d+|\d+(?=[eE]))(?:[eE][+-]?\d+)?')
+_radix_re = re.compile(r'(\d+)#([0-9a-zA-Z]+)')
+
+_string_re = re.compile(r'[()\\]')
+_octal_re = re.compile(r'[0-7]{1,3}')
+_escapes = {
+    'n': b'\n', 'r': b'\r', 't': b'\t', 'b': b'\b', 'f': b'\f',
+    '\\': b'\\', '(': b'(', ')': b')',
+}
+
+
+def lex_string(text: str, pos: int, encoding='utf-8'):
+    """
+    Scan a (string) literal whose opening paren ends just before pos.
+
+    Returns the decoded bytes and the position just after the closing paren.
+    """
+    acc = bytearray()
+    depth = 1
+    while True:
+        m = _string_re.search(text, pos)
+        if m is None:
+            raise SyntaxError('unterminated string')
+        acc += text[pos:m.start()].encode(encoding)
+        char = m.group()
+        pos = m.end()
+        if char == '\\':
+            esc = text[pos:pos + 1]
+            if esc in _escapes:
+                acc += _escapes[esc]
+                pos += 1
+            elif esc.isdigit() and esc < '8':
+                m = _octal_re.match(text, pos)
+                acc.append(int(m.group(), 8) & 0xff)
+                pos = m.end()
+            elif esc == '\r':
+                # backslash-newline is a line continuation
+                pos += 2 if text[pos + 1:pos + 2] == '\n' else 1
+            elif esc == '\n':
+                pos += 1
+            # otherwise the backslash is ignored
+        elif char == '(':
+            depth += 1
+            acc += b'('
+        else:
+            depth -= 1
+            if depth == 0:
+                return acc, pos
+            acc += b')'
+
+
+def lex_number(word: str):
+    if _int_re.fullmatch(word):
+        return int(word)
+    if _real_re.fullmatch(word):
+        return float(word)
+    m = _radix_re.fullmatch(word)
+    if m:
+        try:
+            return int(m[2], int(m[1]))
+        except ValueError:
+            pass
+    return None
+
+
+def lex(text: str, encoding='utf-8'):
+    """
+    Tokenize postscript source in a single pass
+
+    Yields postscript objects (numbers, strings, names) directly, with
+    procStart/procEnd marking the { } procedure delimiters. String literals
+    are stored encoded with encoding.
+    """
+    pos = 0
+    end = len(text)
+    match = _token_re.match
+    while pos < end:
+        m = match(text, pos)
+        kind = m.lastgroup
+        word = m.group()
+        pos = m.end()
+        if kind == 'regular':
+            num = lex_number(word)
+            yield ExecutableName(word) if num is None else num
+        elif kind == 'name':
+            yield Name(word[1:])
+        elif kind == 'string':
+            s, pos = lex_string(text, pos, encoding)
+            yield String(s)
+        elif kind == 'array' or kind == 'dict':
+            yield ExecutableName(word)
+        elif kind == 'proc':
+            yield procStart if word == '{' else procEnd
+        elif kind == 'hex':
+            digits = ''.join(word[1:-1].split())
+            if len(digits) % 2:
+                digits += '0'
+            try:
+                yield String(bytearray.fromhex(digits))
+            except ValueError:
+                raise SyntaxError(f'bad hex string {word}') from None
+        elif kind == 'error':
+            raise SyntaxError(f'unexpected {word!r} at offset {m.start()}')
+
 
 def noop(n):
     def wrapper(stack):
@@ -157,6 +370,44 @@ def noop(n):
     return wrapper
 
 
+#
+# Compiled file cache
+
+# Bump whenever the parsed representation changes
+CACHE_VERSION = 3
+
+# The on-disk cache is off unless COFFEY_CACHE_DIR is set. Whatever's in
+# there gets unpickled, so only point it somewhere nobody else can write.
+cache_dir = os.environ.get('COFFEY_CACHE_DIR') or None
+
+# (runner class, encoding, path, mtime, size) -> pickled parse
+_compiled: Dict[tuple, bytes] = {}
+
+
+def read_cache(digest: str) -> Optional[bytes]:
+    if cache_dir is None:
+        return None
+    try:
+        with open(os.path.join(cache_dir, f'{digest}.{CACHE_VERSION}.pickle'), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_cache(digest: str, blob: bytes):
+    if cache_dir is None:
+        return
+    path = os.path.join(cache_dir, f'{digest}.{CACHE_VERSION}.pickle')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
 class QuitException(Exception):
     pass
 
@@ -165,6 +416,66 @@ class ExitException(Exception):
     pass
 
 
+class Save(NamedTuple):
+    """
+    Interpreter state captured by Runner.snapshot()
+    """
+    stack: Optional[list]
+    state: Dict[str, Any]
+
+
+class Globaldict(dict):
+    """
+    dict that drops the cached name bindings whenever it's modified
+    """
+    def __init__(self, bindings: dict, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bindings = bindings
+
+    def __setitem__(self, key, value):
+        self.bindings.clear()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.bindings.clear()
+        super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        self.bindings.clear()
+        super().update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self.bindings.clear()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self.bindings.clear()
+        return super().pop(*args)
+
+    def popitem(self):
+        self.bindings.clear()
+        return super().popitem()
+
+    def clear(self):
+        self.bindings.clear()
+        super().clear()
+
+
+def operator(func, static=False):
+    """
+    Wrap a func_ member into a plain op(stack) returning what to push
+    """
+    def op(stack):
+        ret = func() if static else func(stack)
+        if ret is None:
+            return ()
+        if not isinstance(ret, (tuple, Iterator)):
+            return (ret,)
+        return ret
+    op.__name__ = op.__qualname__ = func.__name__
+    return op
+
+
 class Runner(list):
     """
     > globaldict /def { globaldict 3 1 roll put } put
@@ -172,52 +483,264 @@ class Runner(list):
     """
     globaldict: Dict[str, callable]
     systemdict: Dict[str, Any]
+    bindings: Dict[str, callable]
+    # Where each mark on the stack is, bottom to top. Entries can go stale
+    # when a mark gets popped by something other than unmark, counttomark
+    # skips those.
+    marks: List[int]
+
+    # Checked as each procedure starts, so a runaway program fails instead
+    # of eating memory. Set on an instance to change it for just that runner.
+    max_stack = 100000
 
     def __init__(self, *args):
         super().__init__(*args)
-        self.globaldict = {}
+        self.reindex_marks()
+        self.bindings = {}
+
+        # systemdict and the prelude's definitions only depend on the class,
+        # so build them for the first instance and share them after that
+        template = type(self).__dict__.get('_template')
+        if template is None:
+            self.systemdict = self.build_systemdict()
+            self.globaldict = Globaldict(self.bindings)
+            self.runlines('\n'.join(self.prelude()))
+            type(self)._template = (self.systemdict, dict(self.globaldict))
+        else:
+            self.systemdict, prelude = template
+            self.globaldict = Globaldict(self.bindings, prelude)
 
-        from inspect import getmembers
+    @classmethod
+    def build_systemdict(cls):
+        from inspect import getmembers, getattr_static
 
         def fixname(name):
             if name.startswith('func_hex_'):
                 return bytes.fromhex(name[9:]).decode()
             return name[5:]
-        self.systemdict = {
-            fixname(name): meth for name, meth in getmembers(self, callable)
+        return {
+            fixname(name): meth if hasattr(meth, 'arity') else operator(
+                meth, isinstance(getattr_static(cls, name), staticmethod)
+            )
+            for name, meth in getmembers(cls, callable)
             if name.startswith('func_')
         }
 
-        stream = deque()
-        for line in self.prelude():
-            stream.extend(self.lex(line))
+    #
+    # Snapshots
 
-        self.run(self.parse(stream))
+    # bindings gets rebuilt, systemdict is shared and marks follows the
+    # stack, so leave them out. The rest of these are how far this runner
+    # has got with its copy-on-write, see writable().
+    unsnapshotted = ('bindings', 'systemdict', 'marks', 'shared', 'copied', 'originals')
 
-    def run(self, code):
-        code = list(code)
+    # What the save and restore operators cover, the interpreter's memory.
+    # Anything else a subclass keeps, like the pdfmarks and pages it has
+    # output, is left alone by restore.
+    vm = ('globaldict',)
+
+    shared = False
+    copied: Dict[int, Any] = {}
+    originals: tuple = ()
+
+    def copy_value(self, obj, memo: dict):
+        """
+        Copy the mutable parts of a value for writable() and snapshot()
+
+        dicts, arrays and strings get copied, procedures included. Names,
+        numbers and operators are shared.
+        """
+        new = memo.get(id(obj))
+        if new is not None:
+            return new
+        t = type(obj)
+        if t is dict or t is Globaldict:
+            new = memo[id(obj)] = {}
+            for key, value in obj.items():
+                new[key] = self.copy_value(value, memo)
+        elif t is list:
+            new = memo[id(obj)] = []
+            new.extend(self.copy_value(thing, memo) for thing in obj)
+        elif t is bytearray:
+            new = memo[id(obj)] = bytearray(obj)
+        elif isinstance(obj, ChildSlice):
+            new = memo[id(obj)] = t.__new__(t)
+            vars(new).update(vars(obj))
+            new.parent = self.copy_value(obj.parent, memo)
+            code = vars(obj).get('_code')
+            if code is not None:
+                # Still good, as long as what it pushes is the copies
+                new._code = (code[0], [
+                    (kind, self.copy_value(arg, memo)) if kind is PUSH else (kind, arg)
+                    for kind, arg in code[1]
+                ])
+            vars(new).pop('_key', None)
+        else:
+            return obj
+        return new
+
+    def writable(self, obj):
+        """
+        obj, or this runner's own copy of it, ready to be written to
+
+        A snapshot shares the values in globaldict and on the stack with
+        the runner it came from and whatever restores it, so the first
+        write after one copies them all and carries on with the copies.
+        Writes through anything still holding an original, like a procedure
+        that was running at the time, go to the copy too.
+        """
+        if self.shared:
+            # copied is keyed by id, so hold on to what it was copied from
+            self.originals = (list(self.globaldict.values()), list(self))
+            memo = {}
+            values = {
+                key: self.copy_value(value, memo)
+                for key, value in self.globaldict.items()
+            }
+            self.globaldict.update(values)
+            self[:] = [self.copy_value(thing, memo) for thing in self]
+            self.copied = memo
+            self.shared = False
+        return self.copied.get(id(obj), obj)
+
+    def snapshot(self, stack=True, names: Optional[Container[str]] = None) -> Save:
+        """
+        Capture the interpreter state for restore() or fork(), or just the
+        attributes in names
+
+        Nothing in globaldict or on the stack is copied until something
+        writes to it, procedures included. The rest gets copied now.
+        """
+        state = {}
+        memo = {}
+        for name, value in vars(self).items():
+            if name in self.unsnapshotted or names is not None and name not in names:
+                continue
+            if name == 'globaldict':
+                state[name] = dict(value)
+            else:
+                state[name] = self.copy_value(value, memo)
+        self.shared = True
+        return Save(list(self) if stack else None, state)
+
+    def restore(self, save: Save):
+        """
+        Go back to a snapshot, which stays usable for later restores and forks
+
+        Only the attributes the snapshot has are put back, and the operand
+        stack is left alone if it doesn't include it.
+        """
+        memo = {}
+        # run() holds on to bindings, so empty it rather than replacing it
+        self.bindings.clear()
+        for name, value in save.state.items():
+            if name == 'globaldict':
+                value = Globaldict(self.bindings, value)
+            else:
+                value = self.copy_value(value, memo)
+            setattr(self, name, value)
+        if save.stack is not None:
+            self[:] = save.stack
+            self.reindex_marks()
+        self.shared = True
+
+    def fork(self, save: Optional[Save] = None) -> 'Runner':
+        """
+        New runner starting from save, or from where this one is now
+        """
+        new = type(self).__new__(type(self))
+        new.systemdict = self.systemdict
+        new.bindings = {}
+        new.marks = []
+        new.restore(save if save is not None else self.snapshot())
+        return new
+
+    def compile(self, code):
+        """
+        Turn a sequence of objects into (kind, arg) instructions
+
+        Names in systemdict always win, so they're bound right away. The rest
+        are looked up in globaldict at runtime, through self.bindings.
+        """
+        systemdict = self.systemdict
+        ret = []
         for thing in code:
-            if isinstance(thing, ExecutableName):
-                a = thing(self)
-                self.extend(a)
+            if not isinstance(thing, ExecutableName):
+                ret.append((PUSH, thing))
+            elif thing in systemdict:
+                ret.append((CALL, systemdict[thing]))
+            else:
+                ret.append((LOOKUP, thing))
+        return ret
+
+    def reindex_marks(self):
+        """
+        Find the marks again after the stack's been replaced wholesale
+        """
+        self.marks = [i for i, thing in enumerate(self) if thing is markStart]
+
+    def run(self, code):
+        if len(self) > self.max_stack:
+            raise IndexError('stackoverflow')
+        if isinstance(code, ExecutableArray):
+            code = code.compile(self)
+        else:
+            code = self.compile(code)
+        append = self.append
+        extend = self.extend
+        bindings = self.bindings
+        for kind, arg in code:
+            if kind is PUSH:
+                append(arg)
+            elif kind is CALL:
+                extend(arg(self))
             else:
-                self.append(thing)
+                op = bindings.get(arg)
+                if op is None:
+                    op = self.bind(arg)
+                extend(op(self))
 
     def stackify(unbound_func):
-        from functools import wraps
+        """
+        Turn func(*args) into op(stack): pop the arguments off the stack, and
+        return what to push back.
+
+        Arity comes from the signature and what gets pushed from the return
+        annotation, both worked out once here: -> None pushes nothing,
+        -> tuple pushes each item, anything else pushes the one result.
+        """
         from inspect import signature
 
-        # bleh
-        @wraps(unbound_func.__get__(int))
-        def wrapper(self):
-            func = unbound_func.__get__(self)
-            numargs = len(signature(func).parameters)
-            if len(self) < numargs:
-                breakpoint()
-            args = [self.pop() for _ in range(numargs)]
-            args.reverse()
-            return func(*args)
-        return wrapper
+        static = isinstance(unbound_func, staticmethod)
+        func = unbound_func.__func__ if static else unbound_func
+        numargs = len(signature(func).parameters) - (not static)
+        returns = func.__annotations__.get('return', object)
+        if returns is None:
+            shape = 0
+        elif returns is tuple or get_origin(returns) is tuple:
+            shape = 2
+        else:
+            shape = 1
+
+        def op(stack):
+            if numargs:
+                if len(stack) < numargs:
+                    raise IndexError(f'stackunderflow in {func.__name__}')
+                args = stack[-numargs:]
+                del stack[-numargs:]
+            else:
+                args = ()
+            ret = func(*args) if static else func(stack, *args)
+            if shape == 1:
+                return (ret,)
+            if shape == 0:
+                return ()
+            return ret
+
+        op.__name__ = op.__qualname__ = func.__name__
+        op.__doc__ = func.__doc__
+        op.arity = numargs
+        return op
 
     #
     # Arithmetic
@@ -232,6 +755,11 @@ class Runner(list):
     def func_sub(a, b):
         return a - b
 
+    @stackify
+    @staticmethod
+    def func_mul(a, b):
+        return a * b
+
     @stackify
     @staticmethod
     def func_bitshift(a, b):
@@ -252,11 +780,21 @@ class Runner(list):
     def func_min(a, b):
         return a if a < b else b
 
+    @stackify
+    @staticmethod
+    def func_max(a, b):
+        return a if a > b else b
+
     @stackify
     @staticmethod
     def func_neg(a):
         return -a
 
+    @stackify
+    @staticmethod
+    def func_cvi(a) -> int:
+        return int(float(str(a))) if isinstance(a, String) else int(a)
+
     #
     # Constants
     @staticmethod
@@ -271,20 +809,40 @@ class Runner(list):
     # Stack helpers
 
     @stackify
-    def func_roll(self, n: int, j: int):
+    def func_roll(self, n: int, j: int) -> None:
         """roll
         > /exch { 2 1 roll } def
         """
-        buf = self[-n:]
-        self[-n:] = []
+        if n > len(self):
+            raise IndexError('stackunderflow in roll')
+        if n == 0:
+            return
+        j %= n
+        base = len(self) - n
+        # Shuffle in place, the stack never shrinks or grows doing it
+        if j == 1:
+            self.insert(base, self.pop())
+        elif j == n - 1:
+            self.append(self.pop(base))
+        elif j:
+            self[base:] = self[-j:] + self[base:-j]
+        else:
+            return
 
-        self.extend(buf[-j:] + buf[:-j])
+        marks = self.marks
+        if marks and marks[-1] >= base:
+            while marks and marks[-1] >= base:
+                marks.pop()
+            marks.extend(
+                i for i in range(base, len(self)) if self[i] is markStart
+            )
 
     func_pop = noop(1)
 
     @stackify
-    @staticmethod
-    def func_dup(a):
+    def func_dup(self, a) -> tuple:
+        if a is markStart:
+            self.marks.append(len(self) + 1)
         return a, a
 
     #
@@ -292,13 +850,13 @@ class Runner(list):
 
     @stackify
     @staticmethod
-    def func_hex_3D(a):
+    def func_hex_3D(a) -> None:
         " = "
         print(a)
 
     @stackify
     @staticmethod
-    def func_hex_3D3D(a):
+    def func_hex_3D3D(a) -> None:
         " == "
         print(repr(a))
 
@@ -320,18 +878,18 @@ class Runner(list):
 
     @stackify
     @staticmethod
-    def func_file(fname, mode):
+    def func_file(fname, mode) -> tuple:
         return (open(str(fname), str(mode)),)
 
     #
     # Mark functions
 
-    @staticmethod
-    def func_mark():
+    def func_mark(self):
         """ [
         > /[ { mark } def
         > /<< { mark } def
         """
+        self.marks.append(len(self))
         return markStart
 
     def func_unmark(self):
@@ -339,6 +897,7 @@ class Runner(list):
         > /] { unmark } def
         """
         count = self.func_counttomark()
+        self.marks.pop()
         if count == 0:
             self.pop()
             return []
@@ -347,7 +906,15 @@ class Runner(list):
         return Array(ret)
 
     def func_counttomark(self):
-        return self[::-1].index(markStart)
+        marks = self.marks
+        top = len(self)
+        while marks:
+            i = marks[-1]
+            # by identity, == on strings would have to decode them
+            if i < top and self[i] is markStart:
+                return top - i - 1
+            marks.pop()
+        raise ValueError('unmatchedmark')
 
     def func_hex_3E3E(self):
         " >> "
@@ -364,24 +931,28 @@ class Runner(list):
         return self.globaldict
 
     def func_systemdict(self):
+        # systemdict is shared between instances until someone might write
+        # to it, then this runner gets its own copy
+        template = type(self).__dict__.get('_template')
+        if template is not None and self.systemdict is template[0]:
+            self.systemdict = dict(self.systemdict)
         return self.systemdict
 
     @stackify
-    @staticmethod
-    def func_put(d: Union[dict, list], key, val):
-        d[key] = val
+    def func_put(self, d: Union[dict, list], key, val) -> None:
+        self.writable(d)[key] = val
 
     @stackify
     @staticmethod
-    def func_get(d: dict, key):
+    def func_get(d: dict, key) -> tuple:
         return (d[key],)
 
     @stackify
-    def func_astore(self, l: list):
+    def func_astore(self, l: list) -> None:
         self.extend(l)
 
     @stackify
-    def func_forall(self, obj, proc):
+    def func_forall(self, obj, proc) -> None:
         if isinstance(obj, (list, UserList)):
             it = ((i,) for i in obj)
         elif isinstance(obj, dict):
@@ -413,7 +984,7 @@ class Runner(list):
         return not b
 
     @stackify
-    def func_ifelse(self, cond: bool, a: Executable, b: Executable):
+    def func_ifelse(self, cond: bool, a: Executable, b: Executable) -> tuple:
         """
         > /if { {} ifelse } def
         """
@@ -423,7 +994,7 @@ class Runner(list):
             return b(self)
 
     @stackify
-    def func_loop(self, block: Executable):
+    def func_loop(self, block: Executable) -> None:
         while True:
             try:
                 block(self)
@@ -440,19 +1011,30 @@ class Runner(list):
 
     @stackify
     def func_copy(self, d1, d2):
+        d2 = self.writable(d2)
         d2.update(d1)
         return d2
 
     # Postscript specific stuff
 
     @stackify
-    def func_exec(self, obj):
+    def func_exec(self, obj) -> tuple:
         """
         > /run { (r) file exec } def
         """
         if isinstance(obj, Executable):
             return obj(self)
-        return self.runlines(obj.read())
+        self.run(self.load(obj))
+        return ()
+
+    def func_save(self):
+        return (self.snapshot(stack=False, names=self.vm),)
+
+    @stackify
+    def func_restore(self, save: Save) -> None:
+        if not isinstance(save, Save):
+            raise TypeError(type(save))
+        self.restore(save)
 
     def func_quit(self):
         raise QuitException()
@@ -483,10 +1065,14 @@ class Runner(list):
             return Name('stringtype')
         elif isinstance(thing, int):
             return Name('integertype')
+        elif isinstance(thing, float):
+            return Name('realtype')
         elif isinstance(thing, (list, Array)):
             return Name('arraytype')
         elif isinstance(thing, type(None)):
             return Name('nulltype')
+        elif isinstance(thing, Save):
+            return Name('savetype')
         else:
             raise TypeError(type(thing))
 
@@ -514,7 +1100,7 @@ class Runner(list):
 
     @stackify
     @staticmethod
-    def func_signalerror(something):
+    def func_signalerror(something) -> None:
         raise Exception(something)
 
     @stackify
@@ -541,13 +1127,13 @@ class Runner(list):
         return String(bytearray(l))
 
     @stackify
-    @staticmethod
-    def func_cvs(obj, buf):
-        s = str(obj).encode()
-        l = len(s)
-        ret = String(buf, slice(0, l))
-        ret[:l] = s
-        # print(repr(ret))
+    def func_cvs(self, obj, buf):
+        # strings go straight from buffer to buffer
+        s = obj if isinstance(obj, String) else str(obj).encode()
+        if len(s) > len(buf):
+            raise IndexError('rangecheck in cvs')
+        ret = self.writable(buf)[:len(s)]
+        ret[:] = s
         return ret
 
     @stackify
@@ -556,137 +1142,114 @@ class Runner(list):
         return len(obj)
 
     @stackify
-    @staticmethod
-    def func_putinterval(outer, offset, inner):
-        outer[offset:offset + len(inner)] = inner
-
-    def get_func(self, funcname):
-        if funcname not in self.systemdict:
-            func = self.globaldict[funcname]
-            return func
-        func = self.systemdict[funcname]
+    def func_putinterval(self, outer, offset, inner) -> None:
+        if not 0 <= offset <= len(outer) - len(inner):
+            raise IndexError('rangecheck in putinterval')
+        self.writable(outer)[offset:offset + len(inner)] = inner
 
-        from functools import wraps
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            ret = func()
-            if ret is None:
-                return ()
-            if not isinstance(ret, (tuple, Iterator)):
-                ret = (ret,)
-            return ret
-        return wrapper
-
-    def do_block(self, stream):
-        acc = []
-        while stream:
-            token = stream.popleft()
-            if token.startswith('{'):
-                stream.appendleft(token[1:])
-                acc.append(self.do_block(stream))
-            elif token.endswith('}'):
-                token = token[:-1]
-                if token != '':
-                    # this is gonna cause problems
-                    acc.extend(list(self.parse(deque([token]))))
-                    # acc.append(token)
-                break
-            elif token != '':
-                stream.appendleft(token)
-                acc.extend(list(self.parse(stream, False)))
-        return ExecutableArray(acc)
-
-    def parse(self, stream, consume=True):
-        while stream:
-            token = stream.popleft()
-            if isinstance(token, Array):
-                # Do nothing
-                yield token
-            elif token.isdigit() or token.startswith('-') and token[1:].isdigit():
-                yield int(token)
-            elif token.startswith('/'):
-                yield Name(token[1:])
-            elif token.startswith('('):
-                # this should all move to lex
-                acc = token[0]
-                depth = 1
-                stream.appendleft(token[1:])
-                while depth > 0:
-                    line = deque(stream.popleft())
-                    while line:
-                        char = line.popleft()
-                        if char == '\\':  # this will break on \ before newline
-                            acc += line.popleft()
-                            continue
-                        if char == '(':
-                            depth += 1
-                        elif char == ')':
-                            depth -= 1
-                        acc += char
-                    acc += ' '
-                yield String(acc[1:-2])
-
-                # acc = token
-                # if not token.endswith(')'):
-                #     # This is currently very broken
-                #     while depth > 0:
-                #         token = stream.popleft()
-                #         token = token.replace('\\', '')
-                #         acc += ' ' + token
-                #         if token.startswith('('):
-                #             depth += 1
-                #         if token.endswith(')'):
-                #             depth -= 1
-                # yield String(bytearray(acc[1:-1].encode()))
-            elif token.startswith('{'):
-                stream.appendleft(token[1:])
-                yield self.do_block(stream)
+    def bind(self, funcname):
+        """
+        Resolve a name to a plain op(stack), caching globaldict lookups
+        """
+        if funcname in self.systemdict:
+            return self.systemdict[funcname]
+        op = self.bindings.get(funcname)
+        if op is None:
+            value = self.globaldict[funcname]
+            if isinstance(value, Executable):
+                op = value
             else:
-                yield ExecutableName(token)
-                # yield from self.dispatch_func(token)
-            if not consume:
-                break
+                def op(stack, value=value):
+                    return (value,)
+            self.bindings[funcname] = op
+        return op
 
     @staticmethod
-    def lex(line: str):
-        for word in line.split():
-            if word.startswith('[') and len(word) > 1:
-                yield word[:1]
-                yield word[1:]
-            elif word.endswith(']') and len(word) > 1 and word[-2] != '/':
-                yield word[:-1]
-                yield word[-1:]
-            elif word.startswith('<<') and len(word) > 2:
-                yield word[0:2]
-                yield word[2:]
-            elif word.endswith('>>') and len(word) > 2 and word[-3] != '/':
-                yield word[:-2]
-                yield word[-2:]
+    def parse(tokens):
+        """
+        Assemble lexed tokens into objects, nesting { } into procedures
+        """
+        blocks = []
+        acc = None
+        for token in tokens:
+            if token is procStart:
+                blocks.append(acc)
+                acc = []
+            elif token is procEnd:
+                if acc is None:
+                    raise SyntaxError('unmatched }')
+                proc = ExecutableArray(acc)
+                acc = blocks.pop()
+                if acc is None:
+                    yield proc
+                else:
+                    acc.append(proc)
+            elif acc is None:
+                yield token
             else:
-                yield word
+                acc.append(token)
+        if acc is not None:
+            raise SyntaxError('unmatched {')
+
+    # What lex stores string literals as, part of load()'s cache keys
+    encoding = 'utf-8'
+    lex = staticmethod(lex)
 
     def prelude(self):
         from inspect import getdoc, getmembers
-        for line in (getdoc(self) or '').splitlines():
-            if line.startswith('> '):
-                yield line[1:].lstrip()
+        # Every class's docstring, so subclasses can document themselves
+        for cls in reversed(type(self).__mro__):
+            for line in (cls.__dict__.get('__doc__') or '').splitlines():
+                line = line.strip()
+                if line.startswith('> '):
+                    yield line[1:].lstrip()
         for name, meth in getmembers(self, callable):
             for line in (getdoc(meth) or '').splitlines():
                 if line.startswith('> '):
                     yield line[1:].lstrip()
 
+    def load(self, f) -> list:
+        """
+        Parsed contents of an open postscript file
+
+        Kept in memory by path and mtime, and on disk in cache_dir (if set) by
+        content hash, so library files only get lexed and parsed once. Both
+        go by the runner class and its lexer's encoding too, those change
+        what the same text parses to. Each call unpickles fresh objects so
+        runners never see each other's writes.
+        """
+        if not isinstance(getattr(f, 'name', None), str):
+            return list(self.parse(self.lex(f.read())))
+        st = os.fstat(f.fileno())
+        cls = type(self)
+        flavor = f'{cls.__module__}.{cls.__qualname__}\0{self.encoding}\0'
+        key = (flavor, os.path.abspath(f.name), st.st_mtime_ns, st.st_size)
+        blob = _compiled.get(key)
+        if blob is None:
+            text = f.read()
+            digest = hashlib.blake2b((flavor + text).encode(), digest_size=16).hexdigest()
+            blob = read_cache(digest)
+            if blob is not None:
+                try:
+                    code = pickle.loads(blob)
+                except Exception:
+                    # Truncated or stale, just rebuild it
+                    blob = None
+                else:
+                    _compiled[key] = blob
+                    return code
+            code = list(self.parse(self.lex(text)))
+            blob = pickle.dumps(code, pickle.HIGHEST_PROTOCOL)
+            write_cache(digest, blob)
+            _compiled[key] = blob
+            return code
+        return pickle.loads(blob)
+
     def runline(self, line):
-        self.run(self.parse(deque(self.lex(line))))
+        self.run(self.parse(self.lex(line)))
 
     def runlines(self, lines):
-        stream = deque()
-        for line in lines.splitlines():
-            for word in self.lex(line):
-                if word == '%':
-                    break
-                stream.append(word)
-
-        self.run(self.parse(stream))
+        self.run(self.parse(self.lex(lines)))
 
     def __call__(self, code: str):
         try:
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+# PostScript procedures to Acrobat JavaScript
+#
+# Same output as ps2js.ps, which stays around for other interpreters, but
+# built up in python instead of with join/putinterval and counttomark rolls
+# on the operand stack. PdfmarkRunner has it as the ps2js operator.
+#
+# Library pulls what a document's calculations have in common out into one
+# document level script. Calculator runs the same procedures here instead,
+# for filling in calculated fields without a viewer.
+
+import re
+from typing import *
+from collections import Counter
+
+import postscript
+from postscript import (
+    Name, ExecutableName, String, ExecutableString, Array, ExecutableArray
+)
+
+stackify = postscript.Runner.stackify
+
+# ps2js.ps's operators table, name -> (operands, format)
+OPERATORS = {
+    'mul': (2, '{} * {}'),
+    'add': (2, '{} + {}'),
+    'sub': (2, '{} - {}'),
+    'eq': (2, '{} == {}'),
+    'or': (2, '{} || {}'),
+    'ifelse': (3, '{} ? {} : {}'),
+    'value=': (1, 'event.target.value = {}'),
+    'this.getField': (1, 'this.getField({})'),
+    'min': (2, 'Math.min({}, {})'),
+    'max': (2, 'Math.max({}, {})'),
+    'cvi': (1, 'Number({})'),
+    '.value': (1, '{}.value'),
+    'event.target': (0, 'event.target'),
+    '.name': (1, '{}.name'),
+}
+
+# What javascript's Number() takes as a decimal number
+NUMBER = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+
+def get_value(name: str) -> str:
+    return f'this.getField("{name}").value'
+
+
+class Compiler:
+    """
+    ps2js for one call
+
+    resolve turns an executable name (a variable holding a field's id) into
+    the field's full name, each one is only resolved once per call, see
+    resolved. Given a cache (one per runner), output is kept against the
+    procedure itself and reused as long as its contents and the full names
+    of the fields its variables hold stay the same.
+    """
+    def __init__(self, resolve: Callable[[ExecutableName], str],
+                 cache: Optional[dict] = None):
+        self.resolve = resolve
+        # Variable -> full field name, for everything resolved so far
+        self.resolved = {}
+        self.cache = cache
+
+    def field(self, name: ExecutableName) -> str:
+        full = self.resolved.get(name)
+        if full is None:
+            full = self.resolved[name] = self.resolve(name)
+        return full
+
+    def state(self, obj, out: list) -> list:
+        """
+        Everything but the procedure's identity the output depends on: the
+        contents of each array and string in it, and the fields its
+        variables resolve to, labels of the parents they've been put under
+        since included
+        """
+        if isinstance(obj, Array):
+            out.append(obj.key() if isinstance(obj, ExecutableArray) else tuple(obj))
+            for item in obj:
+                self.state(item, out)
+        elif isinstance(obj, ExecutableName) and obj not in OPERATORS:
+            out.append(self.field(obj))
+        elif isinstance(obj, String):
+            out.append(str(obj))
+        return out
+
+    def __call__(self, obj) -> list:
+        if self.cache is None:
+            out = []
+            self.emit(obj, out)
+        else:
+            state = self.state(obj, [])
+            entry = self.cache.get(id(obj))
+            if entry is not None and entry[0] is obj and entry[1] == state:
+                out = entry[2]
+            else:
+                out = []
+                self.emit(obj, out)
+                # Holds on to obj, so its id can't be reused
+                out = tuple(out)
+                self.cache[id(obj)] = (obj, state, out)
+        return [
+            ExecutableString(js) if isinstance(js, str) else js for js in out
+        ]
+
+    def emit(self, obj, out: list):
+        if isinstance(obj, ExecutableArray):
+            for item in obj:
+                if isinstance(item, Name) and item in OPERATORS:
+                    operands, fmt = OPERATORS[item]
+                    if len(out) < operands:
+                        raise IndexError(f'stackunderflow in ps2js {item}')
+                    args = out[len(out) - operands:]
+                    del out[len(out) - operands:]
+                    out.append('(' + fmt.format(*args) + ')')
+                else:
+                    self.emit(item, out)
+        elif isinstance(obj, Array):
+            out.append(obj)
+        elif isinstance(obj, ExecutableName):
+            out.append(get_value(self.field(obj)))
+        elif isinstance(obj, Name):
+            out.append(get_value(obj))
+        else:
+            out.append(literal(obj))
+
+    def tree(self, obj, out: list):
+        """
+        Like emit, but Exprs for Library instead of javascript
+        """
+        if isinstance(obj, ExecutableArray):
+            for item in obj:
+                if isinstance(item, Name) and item in OPERATORS:
+                    operands, _ = OPERATORS[item]
+                    if len(out) < operands:
+                        raise IndexError(f'stackunderflow in ps2js {item}')
+                    args = tuple(out[len(out) - operands:])
+                    del out[len(out) - operands:]
+                    out.append(Expr(str(item), args))
+                else:
+                    self.tree(item, out)
+        elif isinstance(obj, Array):
+            raise TypeError(f'typecheck in ps2js library: {obj!r}')
+        elif isinstance(obj, ExecutableName):
+            out.append(Expr(FIELD, (self.field(obj),)))
+        elif isinstance(obj, Name):
+            out.append(Expr(FIELD, (str(obj),)))
+        else:
+            out.append(Expr(JS, (literal(obj),)))
+
+
+def literal(obj) -> str:
+    if isinstance(obj, int) and not isinstance(obj, bool):
+        return str(obj)
+    elif isinstance(obj, ExecutableString):
+        # Already javascript
+        return str(obj)
+    elif isinstance(obj, String):
+        return f'"{obj}"'
+    elif obj is None:
+        return 'null'
+    raise TypeError(f'typecheck in ps2js: {obj!r}')
+
+
+#
+# Document level library
+
+# Expr ops that aren't OPERATORS
+FIELD, JS = '', 'js'
+
+
+class Expr(NamedTuple):
+    """
+    An operator and its operand Exprs, or a FIELD and its name, or some JS
+    """
+    op: str
+    args: tuple
+
+
+def reads(expr: Expr, target: str, found: Optional[Set[str]] = None) -> Set[str]:
+    """
+    Names of the fields expr reads, event.target being the field called target
+    """
+    if found is None:
+        found = set()
+    if expr.op == FIELD:
+        found.add(expr.args[0])
+    elif expr.op == JS:
+        if 'event' in expr.args[0]:
+            found.add(target)
+    else:
+        if expr.op == 'event.target':
+            found.add(target)
+        for arg in expr.args:
+            reads(arg, target, found)
+    return found
+
+
+class Library:
+    """
+    One document level script for the calculations ps2js compiled
+
+    Any expression that turns up more than once, up to which fields it
+    reads, becomes a function taking those fields' names, so most actions
+    are a call or two. Fields go through $f, which keeps each one's handle
+    for as long as the document's open instead of calling getField again on
+    every calculation.
+    """
+    prelude = (
+        'var $doc = this, $fields = {};\n'
+        'function $f(name) {\n'
+        '  return $fields[name] || ($fields[name] = $doc.getField(name));\n'
+        '}\n'
+    )
+
+    def __init__(self):
+        # key -> Expr, one per calculation
+        self.exprs = {}
+        # id(Expr) -> shape()
+        self.shapes = {}
+
+    def add(self, key, expr: Expr):
+        self.exprs[key] = expr
+
+    def shape(self, expr: Expr) -> Tuple[str, List[str]]:
+        """
+        expr's javascript with the fields it reads as parameters p0, p1...,
+        and those fields
+        """
+        cached = self.shapes.get(id(expr))
+        if cached is None:
+            fields = []
+
+            def param(field):
+                if field not in fields:
+                    fields.append(field)
+                return f'p{fields.index(field)}'
+
+            text = self.render(expr, param, {}, None)
+            cached = self.shapes[id(expr)] = (text, fields)
+        return cached
+
+    def render(self, expr: Expr, arg: Callable[[str], str], functions: Dict[str, str],
+               calls: Optional[Counter], inside: Optional[Expr] = None) -> str:
+        """
+        javascript for expr, with arg(field name) for each field and a call
+        for everything in functions (shape -> function name) bar inside
+        """
+        if expr.op == FIELD:
+            return f'$f({arg(expr.args[0])}).value'
+        elif expr.op == JS:
+            return expr.args[0]
+        if functions and expr is not inside:
+            shape, fields = self.shape(expr)
+            function = functions.get(shape)
+            if function is not None:
+                calls[function] += 1
+                return f'{function}({", ".join(arg(field) for field in fields)})'
+        _, fmt = OPERATORS[expr.op]
+        args = (self.render(a, arg, functions, calls) for a in expr.args)
+        return '(' + fmt.format(*args) + ')'
+
+    def count(self, expr: Expr, counts: Counter, examples: dict):
+        if expr.op in (FIELD, JS):
+            return
+        shape, fields = self.shape(expr)
+        if fields and OPERATORS[expr.op][0]:
+            counts[shape] += 1
+            examples.setdefault(shape, expr)
+        for arg in expr.args:
+            self.count(arg, counts, examples)
+
+    def build(self) -> Tuple[str, Dict[Any, str]]:
+        """
+        The document script, and each calculation's javascript using it
+        """
+        counts = Counter()
+        examples = {}
+        for expr in self.exprs.values():
+            self.count(expr, counts, examples)
+        shared = [shape for shape, n in counts.items() if n > 1]
+        while True:
+            functions = {shape: f'$c{i}' for i, shape in enumerate(shared)}
+            calls = Counter()
+            actions = {
+                key: self.render(expr, '"{}"'.format, functions, calls)
+                for key, expr in self.exprs.items()
+            }
+            script = [self.prelude]
+            for shape in shared:
+                example = examples[shape]
+                params = {field: f'p{i}' for i, field in enumerate(self.shape(example)[1])}
+                body = self.render(example, params.__getitem__, functions, calls, example)
+                script.append(f'function {functions[shape]}({", ".join(params.values())}) {{\n'
+                              f'  return {body};\n}}\n')
+            # Only called from one place after all, once whatever it was
+            # part of got its own function
+            once = [shape for shape in shared if calls[functions[shape]] < 2]
+            if not once:
+                return ''.join(script), actions
+            shared = [shape for shape in shared if shape not in once]
+
+
+#
+# Evaluating
+
+def to_number(v):
+    """
+    javascript's Number()
+    """
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, (int, float)):
+        return v
+    if v is None:
+        return 0
+    v = str(v).strip()
+    if not v:
+        return 0
+    if v.lstrip('+-') == 'Infinity':
+        return float(v.replace('Infinity', 'inf'))
+    if NUMBER.fullmatch(v) is None:
+        # python's float() would take inf, nan and 1_000 too
+        return float('nan')
+    return float(v) if any(c in v for c in '.eE') else int(v)
+
+
+def to_string(v) -> str:
+    """
+    javascript's String()
+    """
+    if isinstance(v, bool):
+        return 'true' if v else 'false'
+    if isinstance(v, float):
+        if v != v:
+            return 'NaN'
+        if v in (float('inf'), float('-inf')):
+            return 'Infinity' if v > 0 else '-Infinity'
+        if v.is_integer():
+            return str(int(v))
+        return repr(v)
+    if v is None:
+        return 'null'
+    return str(v)
+
+
+def truthy(v) -> bool:
+    if isinstance(v, float) and v != v:
+        return False
+    return bool(v)
+
+
+def field_value(v):
+    """
+    What a field's .value gives for a /V: numbers if it looks like one
+    """
+    if isinstance(v, str) and v.strip():
+        n = to_number(v)
+        if n == n:
+            return n
+    return v
+
+
+class Calculator(postscript.Runner):
+    """
+    Runs the procedures ps2js compiles, but with javascript's semantics, so
+    the results match what a viewer would work out
+
+    Literal names are fields, like they are to ps2js, and stand for the
+    field's value wherever an operand is used. Variables holding a field's
+    id are defined to its literal name before each run.
+    """
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Field name -> .value
+        self.values = {}
+        self.target = None
+        self.result = None
+
+    def value(self, v):
+        if isinstance(v, Name) and not isinstance(v, ExecutableName):
+            return self.values.get(str(v), '')
+        elif isinstance(v, String):
+            return str(v)
+        return v
+
+    def calculate(self, proc, target: str, variables: Dict[str, str],
+                  values: Dict[str, Any]) -> str:
+        """
+        The value proc works out for the field named target
+        """
+        self.values = values
+        self.target = target
+        self.result = None
+        for var, name in variables.items():
+            self.globaldict[var] = Name(name)
+        del self[:]
+        self.reindex_marks()
+        self.run(proc)
+        if self.result is None:
+            if len(self) != 1:
+                raise ValueError(f'{target} calculation left {len(self)} values')
+            self.result = self.value(self.pop())
+        return to_string(self.result)
+
+    @stackify
+    def func_add(self, a, b):
+        a, b = self.value(a), self.value(b)
+        if isinstance(a, str) or isinstance(b, str):
+            return to_string(a) + to_string(b)
+        return to_number(a) + to_number(b)
+
+    @stackify
+    def func_sub(self, a, b):
+        return to_number(self.value(a)) - to_number(self.value(b))
+
+    @stackify
+    def func_mul(self, a, b):
+        return to_number(self.value(a)) * to_number(self.value(b))
+
+    @stackify
+    def func_eq(self, a, b) -> bool:
+        a, b = self.value(a), self.value(b)
+        if isinstance(a, str) and isinstance(b, str):
+            return a == b
+        if isinstance(a, str) or isinstance(b, str):
+            return to_number(a) == to_number(b)
+        return a == b
+
+    @stackify
+    def func_or(self, a, b):
+        a = self.value(a)
+        return a if truthy(a) else self.value(b)
+
+    @stackify
+    def func_min(self, a, b):
+        return min(to_number(self.value(a)), to_number(self.value(b)))
+
+    @stackify
+    def func_max(self, a, b):
+        return max(to_number(self.value(a)), to_number(self.value(b)))
+
+    @stackify
+    def func_cvi(self, a):
+        # ps2js makes this Number()
+        return to_number(self.value(a))
+
+    @stackify
+    def func_ifelse(self, cond, a, b) -> tuple:
+        # ps2js takes plain values for either branch too
+        branch = a if truthy(self.value(cond)) else b
+        if isinstance(branch, ExecutableArray):
+            return branch(self)
+        return (branch,)
+
+    @stackify
+    def func_hex_746869732E6765744669656C64(self, name):
+        # this.getField, fields are just their names here
+        return Name(str(name))
+
+    @stackify
+    def func_hex_2E76616C7565(self, field):
+        # .value
+        return self.value(field)
+
+    @stackify
+    def func_hex_2E6E616D65(self, field) -> String:
+        # .name
+        return String(str(field))
+
+    @stackify
+    def func_hex_6576656E742E746172676574(self) -> Name:
+        # event.target
+        return Name(self.target)
+
+    @stackify
+    def func_hex_76616C75653D(self, v) -> None:
+        # value=
+        self.result = self.value(v)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import os
+import sys
+
+import pytest
+from pdfrw import PdfReader, PdfWriter
+from pdfrw.objects import *
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+OVERLAY = os.path.join(ROOT, 'dor-2020-inc-form-1-nrpy-form-overlay.ps')
+
+
+@pytest.fixture(autouse=True, scope='session')
+def root():
+    """
+    The overlay runs pdfmarklib.ps and co. from the current directory
+    """
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    yield
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope='session')
+def base(tmp_path_factory) -> str:
+    """
+    A blank three page pdf with the fonts the overlay's fields use
+    """
+    writer = PdfWriter()
+    for i in range(3):
+        contents = IndirectPdfDict()
+        contents.stream = f'BT /Helv 12 Tf 72 720 Td (page {i}) Tj ET'
+        writer.addpage(PdfDict(
+            Type=PdfName.Page, MediaBox=[0, 0, 612, 792], Contents=contents
+        ))
+    fonts = PdfDict(
+        ZaDb=IndirectPdfDict(Type=PdfName.Font, Subtype=PdfName.Type1,
+                             BaseFont=PdfName.ZapfDingbats),
+        Helv=IndirectPdfDict(Type=PdfName.Font, Subtype=PdfName.Type1,
+                             BaseFont=PdfName.Helvetica),
+    )
+    writer.trailer.Root.AcroForm = PdfDict(DR=PdfDict(Font=fonts), Fields=PdfArray())
+    fname = str(tmp_path_factory.mktemp('base') / 'base.pdf')
+    writer.write(fname)
+    return fname
+
+
+def dump(obj, seen=()):
+    """
+    What's in obj and everything below it, without object numbers, for
+    comparing pdfs written different ways
+    """
+    if isinstance(obj, PdfDict):
+        if id(obj) in seen:
+            return '<loop>'
+        seen += (id(obj),)
+        out = {
+            str(k): str(v.T) if k == '/Parent' else dump(v, seen)
+            for k, v in obj.items()
+        }
+        if obj.stream is not None:
+            out['stream'] = obj.stream
+        return out
+    if isinstance(obj, list):
+        return [dump(v, seen) for v in obj]
+    return str(obj)
+
+
+def document(fname, reader=PdfReader):
+    """
+    dump() of a pdf's pages, form and document scripts
+    """
+    r = reader(fname)
+    pages = []
+    for page in r.pages:
+        page = PdfDict(page)
+        page.Parent = None
+        pages.append(dump(page))
+    return pages, dump(r.Root.AcroForm), dump(r.Root.Names)
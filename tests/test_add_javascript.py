@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import argparse
+
+import pytest
+from pdfrw import PdfReader
+
+import add_javascript
+import pdfmark
+from add_javascript import Injector, page_range
+from conftest import document
+from lazyreader import LazyReader
+
+# Text fields over two pages, a checkbox and a field with a widget on each
+# of the first two pages
+FORM = """
+[ /Subtype /Widget /FT /Tx /T (a.x) /Rect [0 0 10 10] /ANN pdfmark
+[ /Subtype /Widget /FT /Btn /T (c) /Rect [0 20 10 30] /ANN pdfmark
+[ /_objdef {w} /type /dict /OBJ pdfmark
+[ {w} << /FT /Tx /T (w) /Kids [{w1} {w2}] >> /PUT pdfmark
+[ /_objdef {w1} /Subtype /Widget /Parent {w} /Rect [0 40 10 50] /ANN pdfmark
+showpage
+[ /Subtype /Widget /FT /Tx /T (a.y) /Rect [0 0 10 10] /ANN pdfmark
+[ /_objdef {w2} /Subtype /Widget /Parent {w} /Rect [0 40 10 50] /ANN pdfmark
+showpage
+"""
+
+
+@pytest.fixture(scope='module')
+def form(base, tmp_path_factory) -> str:
+    path = tmp_path_factory.mktemp('form')
+    template = path / 'form.ps'
+    template.write_text(FORM)
+    fname = str(path / 'form.pdf')
+    pdfmark.main(['pdfmark.py', base], str(template), fname)
+    return fname
+
+
+@pytest.mark.parametrize('selectors, expected', [
+    ({}, ['a.x', 'a.y', 'c', 'w']),
+    ({'names': ['a.*']}, ['a.x', 'a.y']),
+    ({'names': ['c', 'a.y']}, ['a.y', 'c']),
+    ({'types': ['Btn']}, ['c']),
+    ({'types': ['/Tx']}, ['a.x', 'a.y', 'w']),
+    ({'pages': {1}}, ['a.y', 'w']),
+    ({'pages': {2}}, []),
+    ({'names': ['a.*'], 'pages': {0}}, ['a.x']),
+    ({'types': ['Tx'], 'pages': {0}}, ['a.x', 'w']),
+])
+def test_select(form, selectors, expected):
+    injector = Injector(LazyReader(form))
+    assert sorted(name for name, _ in injector.select(**selectors)) == expected
+
+
+def test_one_action(form):
+    """
+    Fields given the same script share its action, only calculations go
+    in /CO
+    """
+    injector = Injector(LazyReader(form))
+    fields = [field for _, field in injector.select(types=['Tx'])]
+    assert injector.add(fields, 'x();') == 3
+    assert len({id(field.AA.V) for field in fields}) == 1
+    assert injector.reader.Root.AcroForm.CO is None
+    injector.add(fields[:1], 'x();', 'C')
+    assert fields[0].AA.C is fields[0].AA.V
+    assert list(injector.reader.Root.AcroForm.CO) == fields[:1]
+
+
+def test_page_range():
+    assert page_range('1-2,4, 6-', 7) == {0, 1, 3, 5, 6}
+    assert page_range('-2', 3) == {0, 1}
+    for spec in ('0', '3-2', '8', 'x', '1-9'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            page_range(spec, 7)
+
+
+def scripts(fname, trigger='C'):
+    """
+    Full name -> its trigger's javascript, and /CO by name
+    """
+    acroform = PdfReader(fname).Root.AcroForm
+    js = {
+        name: field.AA[f'/{trigger}'].JS
+        for name, field in add_javascript.terminal_fields(acroform.Fields)
+        if field.AA is not None
+    }
+    order = [pdfmark.partial_name(field) for field in acroform.CO or ()]
+    return js, order
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_main(form, tmp_path, incremental):
+    """
+    -i writes the same document as a full rewrite, appended to the input
+    """
+    script = tmp_path / 'calc.js'
+    script.write_text('event.value = 1;')
+    lib = tmp_path / 'lib.js'
+    lib.write_text('function one() { return 1; }')
+    out = str(tmp_path / 'out.pdf')
+    args = ['add_javascript.py', '-s', str(script), '-t', 'C', '-n', 'a.*',
+            '-p', '2', '-d', f'lib={lib}', form, out]
+    if incremental:
+        args.insert(1, '-i')
+    add_javascript.main(args)
+
+    js, order = scripts(out)
+    assert js == {'a.y': '(event.value = 1;)'}
+    assert order == ['y']
+    assert PdfReader(out).Root.Names.JavaScript.Names[0] == '(lib)'
+    with open(form, 'rb') as f, open(out, 'rb') as g:
+        assert g.read().startswith(f.read()) == incremental
+
+    if incremental:
+        full = str(tmp_path / 'full.pdf')
+        args.remove('-i')
+        args[-1] = full
+        add_javascript.main(args)
+        assert document(out) == document(full)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import os
+
+import pytest
+
+import batch
+from batch import Template, read_records, render_all, render_one
+from conftest import document
+from pdfmark import current_value
+from test_calculations import CHAIN
+
+
+@pytest.fixture(scope='module')
+def template(base):
+    return Template(base, CHAIN)
+
+
+@pytest.fixture
+def records(tmp_path):
+    jsonl = tmp_path / 'r.jsonl'
+    jsonl.write_text(
+        '{"x": 1}\n'
+        '{"x": \n'
+        '[1, 2]\n'
+        '{"_name": "../up", "x": 2}\n'
+        '{"_name": "r-1", "x": 3}\n'
+    )
+    return [str(jsonl), str(tmp_path / 'missing.fdf')]
+
+
+def test_forks_isolated(template):
+    template.filled({'x': 5})
+    runner, _, _ = template.filled({'x': 1})
+    fields = runner.field_index()
+    assert str(current_value(fields['a'])) == '4'
+    assert template.runner.field_index()['x'].V is None
+
+
+@pytest.mark.parametrize('flat', [False, True])
+def test_incremental_matches_full(template, tmp_path, flat):
+    full, inc = tmp_path / 'full', tmp_path / 'inc'
+    full.mkdir()
+    inc.mkdir()
+    render_one(template, str(full), 'r', {'x': 5}, flat=flat)
+    render_one(template, str(inc), 'r', {'x': 5}, incremental=True, flat=flat)
+    assert document(str(inc / 'r.pdf')) == document(str(full / 'r.pdf'))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_bad_records(base, tmp_path, records, jobs):
+    """
+    Records that can't be read or reuse a name fail on their own
+    """
+    out = tmp_path / 'out'
+    out.mkdir()
+    results = sorted(
+        render_all(base, CHAIN, str(out), read_records(records), jobs),
+        key=lambda result: (result[0], result[1] is not None)
+    )
+    names = [name for name, _ in results]
+    assert names == ['.._up', 'missing', 'r-1', 'r-1', 'r-2', 'r-3']
+    errors = [error for _, error in results]
+    assert errors[0] is None and errors[2] is None
+    assert 'FileNotFoundError' in errors[1]
+    assert 'already called r-1' in errors[3]
+    assert 'JSONDecodeError' in errors[4]
+    assert 'json object' in errors[5]
+    assert sorted(os.listdir(out)) == ['.._up.pdf', 'r-1.pdf']
+
+
+def test_crashed_worker(base, tmp_path, monkeypatch):
+    """
+    Only the record that takes its worker down fails
+    """
+    render = batch.render_one
+
+    def crash(template, outdir, name, values, *args):
+        if name == 'crash':
+            os._exit(1)
+        return render(template, outdir, name, values, *args)
+
+    # Forked workers get this too
+    monkeypatch.setattr(batch, 'render_one', crash)
+    records = [(f'r{i}', {'x': i}) for i in range(6)] + [('crash', {})]
+    results = dict(render_all(base, CHAIN, str(tmp_path), iter(records), jobs=2))
+    assert {name for name, error in results.items() if error is not None} == {'crash'}
+    assert len(results) == 7
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import pytest
+
+import postscript
+from batch import Template
+from pdfmark import calculation, current_value
+from ps2js import Compiler, Library
+
+HEADER = """
+(pdfmarklib.ps) run
+/h { 792 exch sub } def
+/bd { } def
+"""
+
+# Calculations listed in the wrong order, c reads b reads a reads x, and one
+# that doesn't read anything
+CHAIN = HEADER + """
+<< (c) label textfield 10 10 h 20 20 fbox { /b 1 add } autocalc >> formfield orphan
+<< (b) label textfield 40 10 h 20 20 fbox { /a 2 mul } autocalc >> formfield orphan
+<< (a) label textfield 70 10 h 20 20 fbox { /x 3 add } autocalc >> formfield orphan
+<< (k) label textfield 70 40 h 20 20 fbox { 6 7 mul } autocalc >> formfield orphan
+<< (x) label textfield 100 10 h 20 20 fbox >> formfield orphan
+"""
+
+# v holds x1 when c1 is compiled, x2 for c2 and c3
+REBOUND = HEADER + """
+/v << (x1) label textfield 100 10 h 20 20 fbox >> formfield dup orphan def
+<< (c1) label textfield 10 40 h 20 20 fbox { v 1 add } autocalc >> formfield orphan
+/v << (x2) label textfield 100 40 h 20 20 fbox >> formfield dup orphan def
+<< (c2) label textfield 40 40 h 20 20 fbox { v 1 add } autocalc >> formfield orphan
+<< (c3) label textfield 70 40 h 20 20 fbox { v 2 add } autocalc >> formfield orphan
+"""
+
+
+def values(runner, names):
+    fields = runner.field_index()
+    return {name: str(current_value(fields[name])) for name in names}
+
+
+@pytest.fixture(scope='module')
+def chain(base):
+    return Template(base, CHAIN)
+
+
+@pytest.fixture(scope='module')
+def rebound(base):
+    return Template(base, REBOUND)
+
+
+def test_calculation_order(chain):
+    assert list(chain.runner.calculated) == ['a', 'b', 'c']
+    co = chain.runner.objects[('Catalog',)].AcroForm.CO
+    assert [str(field.T) for field in co] == ['a', 'b', 'c']
+
+
+def test_precomputed(chain):
+    k = chain.runner.field_index()['k']
+    assert str(k.V) == '42'
+    assert k.AA is None
+
+
+def test_rebound_reads(rebound):
+    assert rebound.runner.calculated == {'c1': {'x1'}, 'c2': {'x2'}, 'c3': {'x2'}}
+
+
+def test_library():
+    runner = postscript.Runner()
+    library = Library()
+    for name, proc in [('c', '{ /b 1 add }'), ('a', '{ /x 1 add }'), ('d', '{ /x 2 mul }')]:
+        exprs = []
+        Compiler(None).tree(next(runner.parse(runner.lex(proc))), exprs)
+        library.add(name, exprs[0])
+    script, actions = library.build()
+    assert script.startswith(Library.prelude)
+    assert 'function $c0(p0) {\n  return ($f(p0).value + 1);\n}\n' in script
+    assert actions == {'c': '$c0("b")', 'a': '$c0("x")', 'd': '($f("x").value * 2)'}
+
+
+def test_rebound_library(rebound):
+    """
+    The library's actions read the same fields as ps2js's did
+    """
+    fields = rebound.runner.field_index()
+    actions = {name: calculation(fields[name]) for name in ('c1', 'c2', 'c3')}
+    assert actions == {
+        'c1': '$c0("x1")', 'c2': '$c0("x2")', 'c3': '($f("x2").value + 2)'
+    }
+
+
+def test_evaluate(chain):
+    runner, _, _ = chain.filled({'x': 5})
+    assert values(runner, 'abcx') == {'a': '8', 'b': '16', 'c': '17', 'x': '5'}
+
+
+def test_rebound_evaluate(rebound):
+    runner, _, _ = rebound.filled({'x1': 5})
+    assert values(runner, ('c1', 'c2', 'c3')) == {'c1': '6', 'c2': '', 'c3': ''}
+    runner, _, _ = rebound.filled({'x2': 5})
+    assert values(runner, ('c1', 'c2', 'c3')) == {'c1': '', 'c2': '6', 'c3': '7'}
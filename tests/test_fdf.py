@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+from fdf import read_fdf, read_xfdf, read_values
+
+XFDF = """<?xml version="1.0" encoding="UTF-8"?>
+<xfdf xmlns="http://ns.adobe.com/xfdf/" xml:space="preserve">
+<f href="form.pdf"/>
+<fields>
+<field name="taxpayer">
+  <field name="name">
+    <field name="first"><value>Jo</value></field>
+    <field name="last"><value>Doë</value></field>
+  </field>
+  <field name="ssn"><value>111223333</value></field>
+</field>
+<field name="choice"><value>a</value><value>b</value></field>
+<field name="blank"><value/></field>
+<field name="dotted.name"><value>x</value></field>
+</fields>
+<ids original="abc" modified="def"/>
+</xfdf>
+"""
+
+# The same values as an fdf
+FDF = r"""%FDF-1.2
+1 0 obj
+<< /FDF << /Fields [
+  << /T (taxpayer) /Kids [
+    << /T (name) /Kids [ << /T (first) /V (Jo) >> << /T (last) /V <FEFF0044006F00EB> >> ] >>
+    << /T (ssn) /V 2 0 R >>
+  ] >>
+  << /T (choice) /V [(a) (b)] >>
+  << /T (blank) /V () >>
+  << /T (dotted.name) /V (x) >>
+] >> >>
+endobj
+2 0 obj
+(111223333)
+endobj
+trailer
+<< /Root 1 0 R >>
+%%EOF
+"""
+
+EXPECTED = {
+    'taxpayer.name.first': 'Jo',
+    'taxpayer.name.last': 'Doë',
+    'taxpayer.ssn': '111223333',
+    'choice': ['a', 'b'],
+    'blank': '',
+    'dotted.name': 'x',
+}
+
+
+def test_read_xfdf(tmp_path):
+    path = tmp_path / 'values.xfdf'
+    path.write_text(XFDF, encoding='utf-8')
+    assert read_xfdf(str(path)) == EXPECTED
+
+
+def test_read_values_by_extension(tmp_path):
+    """
+    Whichever the file is, the values come out the same
+    """
+    xfdf = tmp_path / 'values.XFDF'
+    xfdf.write_text(XFDF, encoding='utf-8')
+    fdf = tmp_path / 'values.fdf'
+    fdf.write_text(FDF, encoding='latin-1')
+    assert read_values(str(xfdf)) == EXPECTED
+    assert read_values(str(fdf)) == read_fdf(str(fdf)) == EXPECTED
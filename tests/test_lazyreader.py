@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import pytest
+
+import pdfmark
+from conftest import OVERLAY, document
+from lazyreader import LazyReader
+
+
+@pytest.mark.parametrize('flags', [[], ['-i']])
+def test_same_as_pdfreader(base, tmp_path, flags):
+    """
+    Reads the base and output the same as PdfReader, -i leaves two xref
+    sections to follow
+    """
+    out = str(tmp_path / 'out.pdf')
+    pdfmark.main(['pdfmark.py', *flags, base], OVERLAY, out)
+    for fname in (base, out):
+        assert document(fname, LazyReader) == document(fname)
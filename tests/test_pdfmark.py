@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import pytest
+from pdfrw import PdfReader, PdfArray
+
+import pdfmark
+import postscript
+from conftest import OVERLAY, document
+
+# Unnamed annotations over two pages: top level fields with and without a
+# /T, and a dotted name with a kid on each page
+UNNAMED = """
+[ /Subtype /Widget /FT /Tx /T (a) /Rect [0 0 10 10] /ANN pdfmark
+[ /Subtype /Widget /FT /Tx /Rect [0 20 10 30] /ANN pdfmark
+[ /Subtype /Widget /FT /Tx /T (g.h) /Rect [0 40 10 50] /ANN pdfmark
+showpage
+[ /Subtype /Widget /FT /Tx /T (g.i) /Rect [0 0 10 10] /ANN pdfmark
+[ /Subtype /Widget /FT /Btn /Rect [0 20 10 30] /ANN pdfmark
+[ /Subtype /Widget /FT /Tx /T (b) /Rect [0 40 10 50] /ANN pdfmark
+showpage
+"""
+
+# Fields that only turn out to be parents on a later page, at the top level
+# and further down
+PARENTS = """
+[ /Subtype /Widget /FT /Tx /T (a) /Rect [0 0 10 10] /ANN pdfmark
+[ /Subtype /Widget /FT /Tx /T (p.q) /Rect [0 20 10 30] /ANN pdfmark
+showpage
+[ /Subtype /Widget /FT /Tx /T (a.b) /Rect [0 0 10 10] /ANN pdfmark
+[ /Subtype /Widget /FT /Tx /T (p.q.r) /Rect [0 20 10 30] /ANN pdfmark
+showpage
+"""
+
+
+def tree(field):
+    """
+    What's in a field and those below it, without object numbers
+    """
+    return (
+        str(field.T), str(field.FT), str(field.SrcPg), str(field.V),
+        [str(x) for x in field.Rect or ()],
+        [tree(kid) for kid in field.Kids or ()],
+    )
+
+
+def fields(fname):
+    return [tree(field) for field in PdfReader(fname).Root.AcroForm.Fields]
+
+
+@pytest.mark.parametrize('template', ['overlay', 'unnamed', 'parents'])
+def test_incremental_fields(base, tmp_path, template):
+    if template == 'overlay':
+        template = OVERLAY
+    else:
+        text = {'unnamed': UNNAMED, 'parents': PARENTS}[template]
+        template = tmp_path / f'{template}.ps'
+        template.write_text(text)
+    full, inc = str(tmp_path / 'full.pdf'), str(tmp_path / 'inc.pdf')
+    pdfmark.main(['pdfmark.py', base], template, full)
+    pdfmark.main(['pdfmark.py', '-i', base], template, inc)
+    assert fields(full)
+    assert fields(inc) == fields(full)
+
+
+@pytest.mark.parametrize('flags', [[], ['-f']])
+def test_incremental_matches_full(base, tmp_path, flags):
+    """
+    An incremental update reads back the same as rewriting the file
+    """
+    full, inc = str(tmp_path / 'full.pdf'), str(tmp_path / 'inc.pdf')
+    pdfmark.main(['pdfmark.py', *flags, base], OVERLAY, full)
+    pdfmark.main(['pdfmark.py', '-i', *flags, base], OVERLAY, inc)
+    assert document(inc) == document(full)
+
+
+def test_restore_keeps_output(base):
+    """
+    restore puts the interpreter back, not the pdfmarks and pages output
+    since the save
+    """
+    runner = pdfmark.PdfmarkRunner(PdfReader(base).Root)
+    runner.runline('/x 1 def save /x 2 def')
+    runner.runline('[ /Subtype /Widget /FT /Tx /T (a) /Rect [0 0 10 10] /ANN pdfmark')
+    runner.runline('showpage restore x')
+    assert [annot.T for annot in runner.annots] == ['a']
+    assert runner.page == 2
+    assert runner.pop() == 1
+
+
+def test_pool_shares_values(base, tmp_path):
+    """
+    Identical nested values become one indirect object, annotations don't
+    """
+    runner = pdfmark.PdfmarkRunner(PdfReader(base).Root)
+    for i in range(3):
+        mk = '0 0 1' if i < 2 else '1 0 0'
+        runner.runline(
+            f'[ /Subtype /Widget /FT /Tx /T (f{i}) /Rect [0 0 10 10] '
+            f'/MK << /BG [{mk}] >> /ANN pdfmark'
+        )
+    a, b, c = runner.annots
+    assert a is not b
+    assert a.MK is b.MK and a.MK.indirect
+    assert c.MK is not a.MK and not c.MK.indirect
+
+    # Changed since, so not handed out again
+    a.MK.BG = PdfArray([0])
+    same = pdfmark.translate({postscript.Name('BG'): [0, 0, 1]}, {}, runner.pool)
+    assert runner.pool(same) is same
+
+    fork = runner.fork()
+    assert fork.pool is not runner.pool
+    assert fork.pool.values == {}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import pytest
+
+import postscript
+from postscript import Name, ExecutableName, String, lex
+
+
+def stack(runner):
+    return [str(x) for x in runner]
+
+
+def tokens(text):
+    return [bytes(t) if isinstance(t, String) else t for t in lex(text)]
+
+
+@pytest.mark.parametrize('text, expected', [
+    (r'(a\nb\t\\\(\))', b'a\nb\t\\()'),
+    ('(a (b) c)', b'a (b) c'),
+    ('(a\\\nb)', b'ab'),
+    ('(a\\\r\nb)', b'ab'),
+    (r'(\q)', b'q'),
+    (r'(\101\0\1234)', b'A\x00S4'),
+    (r'(\777)', b'\xff'),
+    ('<48 65\n6c>', b'Hel'),
+    ('<414>', b'A@'),
+    ('<>', b''),
+])
+def test_lex_strings(text, expected):
+    assert tokens(text) == [expected]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1 -2 +3', [1, -2, 3]),
+    ('1.5 .5 -3. 1e3 1.5E-2', [1.5, .5, -3., 1000., .015]),
+    ('16#FF 8#777 2#101 36#z', [255, 511, 5, 35]),
+    ('2#102 1.2.3 1e', [ExecutableName('2#102'), ExecutableName('1.2.3'),
+                        ExecutableName('1e')]),
+])
+def test_lex_numbers(text, expected):
+    out = tokens(text)
+    assert out == expected
+    assert [type(t) for t in out] == [type(t) for t in expected]
+
+
+def test_lex_comments_and_names():
+    text = 'a % b (c\n/d%e\r{ [/f] << /g >> }'
+    assert tokens(text) == [
+        ExecutableName('a'), Name('d'), postscript.procStart,
+        ExecutableName('['), Name('f'), ExecutableName(']'),
+        ExecutableName('<<'), Name('g'), ExecutableName('>>'), postscript.procEnd,
+    ]
+    assert type(tokens('/d')[0]) is Name
+
+
+@pytest.mark.parametrize('text', ['(abc', '<4g>', ')'])
+def test_lex_errors(text):
+    with pytest.raises(SyntaxError):
+        tokens(text)
+
+
+def test_fork_isolation():
+    """
+    Changing a procedure, or the arrays and strings in it, stays in the fork
+    """
+    r = postscript.Runner()
+    r.runline('/p { 1 { 2 3 } (ab) } def')
+    save = r.snapshot()
+
+    a = r.fork(save)
+    a.runline(
+        'globaldict /p get 0 9 put '
+        'globaldict /p get 1 get 0 8 put '
+        'globaldict /p get 2 get 0 (z) putinterval p'
+    )
+    assert stack(a) == ['9', '[8, 3]', 'zb']
+
+    b = r.fork(save)
+    b.runline('p')
+    assert stack(b) == ['1', '[2, 3]', 'ab']
+
+    r.runline('globaldict /p get 0 7 put')
+    r.restore(save)
+    r.runline('p')
+    assert stack(r) == ['1', '[2, 3]', 'ab']
+
+
+def test_fork_shares_until_written():
+    """
+    A fork uses the snapshot's procedures until it writes to one
+    """
+    r = postscript.Runner()
+    r.runline('/p { 1 { 2 } } def /q { 3 } def')
+    save = r.snapshot()
+    p, q = (save.state['globaldict'][postscript.Name(n)] for n in 'pq')
+
+    a = r.fork(save)
+    a.runline('p q')
+    assert a.globaldict[postscript.Name('p')] is p
+    a.runline('globaldict /p get 0 9 put')
+    assert a.globaldict[postscript.Name('p')] is not p
+    assert a.globaldict[postscript.Name('q')] is not q
+    assert str(p[0]) == '1'
+
+
+def test_names_interned():
+    """
+    One object per name and class, however the name was made
+    """
+    r = postscript.Runner()
+    name = postscript.Name('abc')
+    r.runline('/abc (abc) cvn')
+    assert [n is name for n in r] == [True, True]
+    assert postscript.Name('abc') is name
+    assert postscript.ExecutableName('abc') is not name
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# vim: set fileencoding=utf-8 :
+
+import pytest
+
+from conftest import OVERLAY
+from lazyreader import LazyReader
+from pdfmark import PdfmarkRunner
+
+
+class PsRunner(PdfmarkRunner):
+    """
+    Compiles with ps2js.ps, like other interpreters would
+    """
+    func_ps2js = None
+
+
+def both(base, template):
+    runners = []
+    for cls in (PdfmarkRunner, PsRunner):
+        runner = cls(LazyReader(base).Root)
+        runner(template)
+        runners.append(runner)
+    return runners
+
+
+@pytest.fixture(scope='module')
+def runners(base):
+    return both(base, open(OVERLAY).read())
+
+
+def test_overlay(runners):
+    py, ps = (
+        {name: js for name, (_, js) in runner.calculations().items()}
+        for runner in runners
+    )
+    assert py
+    assert py == ps
+
+
+@pytest.mark.parametrize('proc', [
+    '{ 1 /taxpayer.name.first add }',
+    '{ 1 1 add }',
+    '{ state_fund_taxpayer (Yes) eq { 1 } { 0 } ifelse'
+    ' state_fund_spouse (Yes) eq { 1 } { 0 } ifelse add }',
+    '{ /a /b min 3 max cvi }',
+    '{ event.target .name }',
+    '{ (x) this.getField .value 2 mul value= }',
+    '{ 5 1 sub /q or }',
+    '{ 1 2 3 }',
+    '{ { 1 2 add } 4 mul }',
+])
+def test_same_as_ps(runners, proc):
+    out = []
+    for runner in runners:
+        runner.clear()
+        runner.reindex_marks()
+        runner.runline(proc + ' ps2js')
+        out.append([str(x) for x in runner])
+    assert out[0] == out[1]
+
+
+def test_cached_procedure_under_new_parent(base):
+    """
+    The same procedure compiled again once its field has a parent
+    """
+    template = """
+    (pdfmarklib.ps) run
+    /h { 792 exch sub } def
+    /bd { } def
+    /a << (a) label textfield 10 10 h 20 20 fbox >> formfield def
+    /js { { a 1 add } ps2js } def
+    js
+    [ a ] << (p) label parent >> formfield orphan
+    js
+    """
+    py, ps = ([str(x) for x in runner] for runner in both(base, template))
+    assert py == ps == [
+        '(this.getField("a").value + 1)', '(this.getField("p.a").value + 1)'
+    ]